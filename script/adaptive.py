@@ -0,0 +1,91 @@
+import numpy as np
+
+# Total points of an adaptive grid, by number of swept variables
+ADAPTIVE_BUDGET = {1: 200, 2: 10_000}
+ADAPTIVE_START = {1: 33, 2: 17}
+# Largest error of the linear interpolation between two samples, relative to the range of each greek
+ADAPTIVE_TOLERANCE = 1e-3
+# Intervals are not split below (max - min) / 2 ** ADAPTIVE_MAX_DEPTH, e.g. at a kink of the payoff
+ADAPTIVE_MAX_DEPTH = 12
+
+# The grid starts coarse and uniform, then every round inserts the midpoints of the intervals where a greek is
+# furthest from a straight line, until they are all within the tolerance or the budget is spent. Surfaces are
+# refined a whole row or column at a time, so that they stay a (non-uniform) x by y grid that plotly can draw.
+
+
+def deviations(axis, values):
+    # For every sample, its distance to the chord of its two neighbours relative to the range of the greek,
+    # the largest over the greeks and over the other axes: the error the line or surface would have without it
+    error = np.zeros(len(axis))
+    weight = (axis[1:-1] - axis[:-2]) / (axis[2:] - axis[:-2])
+    weight = weight.reshape((-1,) + (1,) * (values[0].ndim - 1))
+    for value in values:
+        finite = value[np.isfinite(value)]
+        scale = finite.max() - finite.min() if finite.size else 0
+        if scale == 0:
+            continue
+        chord = value[:-2] * (1 - weight) + value[2:] * weight
+        deviation = np.nan_to_num(np.abs(value[1:-1] - chord) / scale)
+        error[1:-1] = np.maximum(error[1:-1], deviation.reshape(len(deviation), -1).max(axis=1))
+    return error
+
+
+def extend(task, axes, values, new):
+    # The grid with the new points of every axis, evaluating only the points that were not there
+    names = list(values)
+
+    def evaluate(axes):
+        if any(len(axis) == 0 for axis in axes):
+            return {name: np.empty([len(axis) for axis in axes]) for name in names}
+        return task(axes)
+
+    if len(axes) == 1:
+        added = evaluate(new)
+        values = {name: np.concatenate([values[name], added[name]]) for name in names}
+    else:
+        (X, Y), (new_X, new_Y) = axes, new
+        columns = evaluate([X, new_Y])
+        rows = evaluate([new_X, np.concatenate([Y, new_Y])])
+        values = {name: np.concatenate([np.concatenate([values[name], columns[name]], axis=1), rows[name]])
+                  for name in names}
+
+    axes = [np.concatenate([axis, points]) for axis, points in zip(axes, new)]
+    orders = [np.argsort(axis, kind='stable') for axis in axes]
+    index = np.ix_(*orders)
+    return [axis[order] for axis, order in zip(axes, orders)], {name: value[index] for name, value in values.items()}
+
+
+def adaptive_grid(task, bounds, budget=None, tolerance=ADAPTIVE_TOLERANCE):
+    # task(axes) evaluates the greeks on the product of `axes`, one array per swept variable.
+    # Returns the greeks and the axes, non-uniform, of at most `budget` points in all.
+    dim = len(bounds)
+    budget = budget or ADAPTIVE_BUDGET[dim]
+    axes = [np.linspace(lo, hi, ADAPTIVE_START[dim]) for lo, hi in bounds]
+    values = task(axes)
+    smallest = [(hi - lo) / 2 ** ADAPTIVE_MAX_DEPTH for lo, hi in bounds]
+
+    while True:
+        # The intervals out of tolerance, worst first, over every axis
+        splits = []
+        for k, axis in enumerate(axes):
+            error = deviations(axis, [np.moveaxis(value, k, 0) for value in values.values()])
+            error = np.maximum(error[:-1], error[1:])
+            wide = np.diff(axis) > smallest[k]
+            splits += [(error[i], k, i) for i in np.flatnonzero((error > tolerance) & wide)]
+
+        sizes = [len(axis) for axis in axes]
+        chosen = [[] for _ in axes]
+        for error, k, i in sorted(splits, reverse=True):
+            sizes[k] += 1
+            if np.prod(sizes) > budget:
+                sizes[k] -= 1
+                continue
+            chosen[k].append(i)
+        if not any(chosen):
+            return values, axes
+
+        new = []
+        for axis, indices in zip(axes, chosen):
+            indices = np.array(indices, dtype=int)
+            new.append((axis[indices] + axis[indices + 1]) / 2)
+        axes, values = extend(task, axes, values, new)
@@ -0,0 +1,219 @@
+import io
+import json
+import re
+from functools import partial
+
+import numpy as np
+from flask import Blueprint, Response, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from black_scholes_functions import FIELDS, BatchError, black_scholes_merton_batch, parse_greeks
+from export import EXPORT_FORMATS, EXPORT_TYPES, STREAMS
+from implied_volatility import implied_volatility
+from metrics import grid_points
+from parallel import PARALLEL_THRESHOLD, PARALLEL_WORKERS, evaluate_sharded
+from store import results
+
+try:
+    # Optional: several times faster than json on large float arrays
+    import orjson
+except ImportError:
+    orjson = None
+
+API_MAX_ROWS = 500_000
+API_MAX_BYTES = 64 * 2 ** 20
+API_CHUNK_ROWS = 50_000
+
+QUOTE_FIELDS = ['price', 'S', 'K', 'r', 'T']
+NPY_TYPE = 'application/x-npy'
+RESULT_KEY = re.compile(r'grid-[0-9a-f]{40}')
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def parse_json(body, fields=FIELDS):
+    # Contracts are accepted either as a list of rows or as one list per column
+    contracts = body.get('contracts')
+    if isinstance(contracts, list):
+        try:
+            columns = {field: [contract[field] for contract in contracts] for field in ['type'] + fields}
+        except (KeyError, TypeError) as e:
+            raise BatchError(f'Every contract needs the fields type, {", ".join(fields)}: {e}')
+    elif isinstance(contracts, dict):
+        columns = contracts
+    else:
+        raise BatchError('"contracts" must be a list of contracts or a dict of columns')
+
+    try:
+        types = np.asarray(columns['type'], dtype=str)
+        values = [np.asarray(columns[field], dtype=float) for field in fields]
+    except KeyError as e:
+        raise BatchError(f'Missing column {e}')
+    except (TypeError, ValueError) as e:
+        raise BatchError(f'Invalid contract values: {e}')
+
+    return types, values
+
+
+def parse_npy(data, fields=FIELDS):
+    try:
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+        types = array['type'].astype(str)
+        values = [array[field].astype(float) for field in fields]
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        raise BatchError(f'Expected a structured .npy array with the fields type, {", ".join(fields)}: {e}')
+    return types, values
+
+
+def validate(types, values, fields=FIELDS):
+    if types.ndim != 1 or any(column.ndim != 1 for column in values):
+        raise BatchError('Every column must be a flat list of values, one per contract')
+    n = len(types)
+    if n == 0:
+        raise BatchError('No contracts')
+    if n > API_MAX_ROWS:
+        raise BatchError(f'{n} contracts exceed the limit of {API_MAX_ROWS}')
+    if any(column.shape != (n,) for column in values):
+        raise BatchError('All the columns must have the same length')
+    if not np.isin(types, ['call', 'put']).all():
+        raise BatchError('The type of every contract must be "call" or "put"')
+
+    if not all(np.isfinite(column).all() for column in values):
+        raise BatchError('Contract values must be finite numbers')
+    positive = [field for field in fields if field != 'r']
+    if any((column <= 0).any() for field, column in zip(fields, values) if field in positive):
+        raise BatchError(f'{", ".join(positive)} must be strictly positive')
+
+
+def batch_tile(types, values, greeks, start, stop):
+    return black_scholes_merton_batch(types[start:stop], *[column[start:stop] for column in values], greeks=greeks)
+
+
+def compute_chunks(types, values, greeks):
+    size = len(types) * len(greeks)
+    if PARALLEL_WORKERS > 1 and size >= PARALLEL_THRESHOLD:
+        # Large batches are evaluated at once over the cores, then serialized API_CHUNK_ROWS rows at a time
+        output = evaluate_sharded(partial(batch_tile, types, values, greeks), len(types), size)
+        for start in range(0, len(types), API_CHUNK_ROWS):
+            chunk = slice(start, start + API_CHUNK_ROWS)
+            grid_points.inc(len(types[chunk]))
+            yield np.column_stack([output[greek][chunk] for greek in greeks])
+        return
+
+    # Bounded memory: only API_CHUNK_ROWS contracts are evaluated and serialized at a time
+    for start in range(0, len(types), API_CHUNK_ROWS):
+        chunk = slice(start, start + API_CHUNK_ROWS)
+        output = black_scholes_merton_batch(types[chunk], *[column[chunk] for column in values], greeks=greeks)
+        grid_points.inc(len(types[chunk]))
+        yield np.column_stack([output[greek] for greek in greeks])
+
+
+def dump_rows(chunk):
+    if orjson is not None:
+        return orjson.dumps(chunk, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1]
+    return json.dumps(chunk.tolist())[1:-1].encode()
+
+
+def stream_json(types, values, greeks):
+    yield ('{"greeks": ' + json.dumps(greeks) + ', "results": [').encode()
+    for i, chunk in enumerate(compute_chunks(types, values, greeks)):
+        rows = dump_rows(chunk)
+        yield rows if i == 0 else b', ' + rows
+    yield b']}'
+
+
+def stream_npy(types, values, greeks):
+    dtype = np.dtype([(greek, np.float64) for greek in greeks])
+
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                  'fortran_order': False,
+                                                  'shape': (len(types),)})
+    yield header.getvalue()
+
+    for chunk in compute_chunks(types, values, greeks):
+        yield np.ascontiguousarray(chunk).view(dtype).tobytes()
+
+
+def too_large():
+    return request.content_length is not None and request.content_length > API_MAX_BYTES
+
+
+@api.before_request
+def read_body():
+    # Bodies without a Content-Length (chunked) are cut off at the server's MAX_CONTENT_LENGTH while they are read,
+    # silently: reading past the cut raises RequestEntityTooLarge, rather than failing to parse what was kept
+    request.get_data()
+    request.stream.read(1)
+
+
+@api.errorhandler(RequestEntityTooLarge)
+def body_too_large(e):
+    return jsonify(error=f'Request bodies are limited to {API_MAX_BYTES} bytes'), 413
+
+
+@api.route('/greeks', methods=['POST'])
+def greeks():
+    if too_large():
+        return jsonify(error=f'Request bodies are limited to {API_MAX_BYTES} bytes'), 413
+
+    try:
+        if request.mimetype == NPY_TYPE:
+            types, values = parse_npy(request.get_data())
+            greeks = parse_greeks(request.args.get('greeks'))
+        else:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
+                raise BatchError('Expected a JSON object with a "contracts" field')
+            types, values = parse_json(body)
+            greeks = parse_greeks(body.get('greeks', request.args.get('greeks')))
+        validate(types, values)
+    except BatchError as e:
+        return jsonify(error=str(e)), 400
+
+    if NPY_TYPE in request.accept_mimetypes.values():
+        return Response(stream_npy(types, values, greeks), mimetype=NPY_TYPE)
+    return Response(stream_json(types, values, greeks), mimetype='application/json')
+
+
+@api.route('/implied-volatility', methods=['POST'])
+def implied_volatilities():
+    if too_large():
+        return jsonify(error=f'Request bodies are limited to {API_MAX_BYTES} bytes'), 413
+
+    try:
+        if request.mimetype == NPY_TYPE:
+            types, values = parse_npy(request.get_data(), QUOTE_FIELDS)
+        else:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
+                raise BatchError('Expected a JSON object with a "contracts" field')
+            types, values = parse_json(body, QUOTE_FIELDS)
+        validate(types, values, QUOTE_FIELDS)
+    except BatchError as e:
+        return jsonify(error=str(e)), 400
+
+    result = implied_volatility(types, *values)
+    grid_points.inc(len(types))
+
+    # Quotes without a solution (e.g. outside the no-arbitrage bounds, or too flat in sigma) have a null sigma
+    sigma = result['sigma']
+    return jsonify(sigma=np.where(result['converged'], sigma, None).tolist(),
+                   converged=result['converged'].tolist(),
+                   iterations=result['iterations'].tolist(),
+                   method=result['method'].tolist())
+
+
+@api.route('/export/<key>', methods=['GET'])
+def export(key):
+    # The full grid behind the result_key of the app, with every greek, streamed from the result cache
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        return jsonify(error=f'Unknown format "{format}", expected one of {EXPORT_FORMATS}'), 400
+
+    result = results.get(key) if RESULT_KEY.fullmatch(key) else None
+    if result is None:
+        return jsonify(error='No such result: it may have expired, submit it again'), 404
+
+    return Response(STREAMS[format](result), mimetype=EXPORT_TYPES[format],
+                    headers={'Content-Disposition': f'attachment; filename=greeks.{format}'})
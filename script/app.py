@@ -1,12 +1,17 @@
 import os
 
 from dash import Dash, DiskcacheManager, CeleryManager
+from flask import Response
 from dash.dependencies import Input, State, Output
 from dash.exceptions import PreventUpdate
 
+from api import API_MAX_BYTES, api
 from constants import *
 from items import *
 from layout import *
+from metrics import render_metrics, monitored, timed
+from portfolio import parse_positions
+from store import cache
 from utils import *
 
 if 'REDIS_URL' in os.environ:
@@ -18,9 +23,6 @@ if 'REDIS_URL' in os.environ:
 
 else:
     # Diskcache for non-production apps when developing locally
-    import diskcache
-
-    cache = diskcache.Cache("./cache")
     background_callback_manager = DiskcacheManager(cache)
 
 app_title = 'Option Greeks 3D visualizer'
@@ -47,12 +49,23 @@ meta_tags = [
 app = Dash(__name__,
            meta_tags=meta_tags,
            background_callback_manager=background_callback_manager,
-           prevent_initial_callbacks=True)
+           prevent_initial_callbacks=True,
+           suppress_callback_exceptions=True)
 
 server = app.server
+# Also bounds the bodies sent without a Content-Length, which api.too_large cannot see. Werkzeug rejects a stream
+# that reaches its limit, hence the extra byte: a body of exactly API_MAX_BYTES is accepted either way.
+server.config['MAX_CONTENT_LENGTH'] = API_MAX_BYTES + 1
+server.register_blueprint(api)
 app.layout = LAYOUT
 app.title = 'OptionGreeks3D'
 
+
+@server.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 app.index_string = '''
                     <!DOCTYPE html>
                     <html>
@@ -138,6 +151,38 @@ def update_output(on):
         return {'display': 'block'}, {'display': 'none'}
 
 
+@app.callback(
+    Output(component_id='positions', component_property='style'),
+    Input(component_id='type', component_property='value'))
+def update_output(type):
+    if type == 'portfolio':
+        return positions_style
+    else:
+        return {'display': 'none'}
+
+
+@app.callback(
+    Output(component_id='scenarios', component_property='style'),
+    Input(component_id='result', component_property='value'))
+def update_output(on):
+    if on == 'pnl':
+        return scenarios_style
+    else:
+        return {'display': 'none'}
+
+
+@app.callback(
+    Output(component_id='yield', component_property='style'),
+    Output(component_id='yield', component_property='placeholder'),
+    Input(component_id='model', component_property='value'))
+def update_output(model):
+    label, kernel, yield_label = MODELS[model]
+    if yield_label:
+        return yield_style, yield_label
+    else:
+        return {'display': 'none'}, None
+
+
 @app.callback(
     [Output(component_id='price_switch', component_property='on'),
      Output(component_id='strike_switch', component_property='on'),
@@ -167,9 +212,15 @@ def example(n_clicks):
 
 @app.callback(
     Output(component_id='loading_output', component_property='children'),
+    Output(component_id='result_key', component_property='data'),
     Input(component_id='submit', component_property='n_clicks'),
     State(component_id='type', component_property='value'),
     State(component_id='result', component_property='value'),
+    State(component_id='resolution', component_property='value'),
+    State(component_id='positions', component_property='value'),
+    State(component_id='scenarios', component_property='value'),
+    State(component_id='model', component_property='value'),
+    State(component_id='yield', component_property='value'),
 
     State(component_id='price_switch', component_property='on'),
     State(component_id='price', component_property='value'),
@@ -196,25 +247,103 @@ def example(n_clicks):
     State(component_id='maturity_min', component_property='value'),
     State(component_id='maturity_max', component_property='value'),
     background=True,
-    running=[(Output("submit", "children"), 'Loading...', 'Submit'),
-             (Output("submit", "disabled"), True, False),
-             (Output("submit", "style"), button_style_off, button_style)]
+    progress=[Output(component_id='preview', component_property='children')],
+    # Clears the preview when the job ends, also when it raises PreventUpdate
+    progress_default=[None],
+    interval=500,
+    # Submit stays enabled while a job runs: a new submit supersedes it, and Dash terminates the old job
+    running=[(Output("submit", "children"), 'Loading...', 'Submit')]
 )
-def graph(n_clicks, type, on,
+def graph(set_progress, n_clicks, type, on, resolution, positions, scenarios, model, q,
           onS, S, Sm, SM,
           onK, K, Km, KM,
           onr, r, rm, rM,
           onv, v, vm, vM,
           onT, T, Tm, TM):
-    S = extract_value(onS, S, Sm, SM)
-    K = extract_value(onK, K, Km, KM)
-    r = extract_value(onr, r, rm, rM)
-    v = extract_value(onv, v, vm, vM)
-    T = extract_value(onT, T, Tm, TM)
+    with timed('extract_value'):
+        S = extract_value(onS, S, Sm, SM)
+        K = extract_value(onK, K, Km, KM)
+        r = extract_value(onr, r, rm, rM)
+        v = extract_value(onv, v, vm, vM)
+        T = extract_value(onT, T, Tm, TM)
+
+    try:
+        with monitored('graph', type=type, on=on, S=S, K=K, r=r, v=v, T=T, resolution=resolution,
+                       positions=positions, scenarios=scenarios, model=model, q=q):
+            if type == 'portfolio':
+                type = parse_positions(positions)
+            tabs, key = website_output(type, on, S, K, r, v, T, n3D=resolution or N3D, set_progress=set_progress,
+                                       scenarios=scenarios, model=model or 'bsm', q=q)
+        return tabs, key
+    except Exception:
+        raise PreventUpdate
+
+
+@app.callback(
+    Output(component_id='div_graph', component_property='children'),
+    Input(component_id='result', component_property='value'),
+    State(component_id='result_key', component_property='data'))
+def switch_greek(on, key):
+    if key is None or on is None:
+        raise PreventUpdate
+
+    try:
+        with monitored('switch_greek', on=on, key=key):
+            return greek_figure(key, on)
+    except Exception:
+        raise PreventUpdate
+
+
+@app.callback(
+    Output(component_id='line', component_property='figure'),
+    Input(component_id='line', component_property='relayoutData'),
+    State(component_id='line', component_property='figure'),
+    State(component_id='result_key', component_property='data'),
+    State(component_id='result', component_property='value'))
+def zoom(relayout, figure, key, on):
+    if not relayout or key is None or on is None:
+        raise PreventUpdate
+
+    try:
+        with monitored('zoom', on=on, key=key):
+            figure = zoom_figure(relayout, figure, key, on)
+    except Exception:
+        raise PreventUpdate
+    if figure is None:
+        raise PreventUpdate
+    return figure
+
+
+@app.callback(
+    Output(component_id='animation', component_property='figure'),
+    Input(component_id='animation_frames', component_property='data'),
+    State(component_id='result_key', component_property='data'),
+    State(component_id='result', component_property='value'),
+    prevent_initial_call=False)
+def load_frames(frames, key, on):
+    # Fired when an animation is displayed: its first response only held the first frame
+    if frames is None or key is None or on is None:
+        raise PreventUpdate
+
+    try:
+        with monitored('load_frames', on=on, key=key):
+            return animation_frames(key, on)
+    except Exception:
+        raise PreventUpdate
+
+
+@app.callback(
+    Output(component_id='div_matrix', component_property='children'),
+    Input(component_id='tabs-graph-matrix', component_property='value'),
+    Input(component_id='result', component_property='value'),
+    State(component_id='result_key', component_property='data'))
+def matrix(tab, on, key):
+    if tab != 'matrix' or key is None or on is None:
+        raise PreventUpdate
 
     try:
-        tabs = website_output(type, on, S, K, r, v, T)
-        return tabs
+        with monitored('matrix', on=on, key=key):
+            return greek_table(key, on)
     except Exception:
         raise PreventUpdate
 
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# The shared cache is opened on import: keep the benchmark runs away from the app's ./cache
+CWD = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix='optiongreeks3d-bench-'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from plotly.io.json import to_json_plotly
+
+from adaptive import ADAPTIVE_BUDGET
+from lattice import binomial_lattice
+from parallel import PARALLEL_WORKERS
+from utils import *
+
+TYPES = ['call', 'put']
+N2D_VALUES = [100, 500, 2000, 10000]
+N3D_VALUES = [25, 50, 100, 300, 500]
+# The lattice is timed up to 100 x 100 points only
+LATTICE_MAX_N = 100
+# Sharded 3D surfaces are timed from 1 to PARALLEL_WORKERS cores on this many points per side
+SCALING_N = 1000
+
+# One swept variable for the 2D views (S), two for the 3D ones (S x T)
+PARAMS_2D = {'S': (10, 100), 'K': 50, 'r': 0.02, 'v': 0.25, 'T': 1}
+PARAMS_3D = {'S': (10, 100), 'K': 50, 'r': 0.02, 'v': 0.25, 'T': (0.1, 3)}
+
+
+def measure(fn, repeat, points, memory=True):
+    fn()
+
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i + 1)
+        timings.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn(repeat + 1)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {'points': points,
+            'repeat': repeat,
+            'p50_ms': float(np.percentile(timings, 50) * 1e3),
+            'p99_ms': float(np.percentile(timings, 99) * 1e3),
+            'points_per_sec': float(points / np.median(timings)),
+            'peak_memory_bytes': peak}
+
+
+def unique(params, i):
+    # A fresh volatility per call so that every website_output run misses the result cache
+    params = dict(params)
+    params['v'] = params['v'] + i * 1e-9
+    return params
+
+
+def bench_kernel(repeat, sizes):
+    rows = []
+    for type in TYPES:
+        for n in sizes:
+            S = np.linspace(10, 100, n * n)
+
+            for kernel in [black_scholes_merton, atlas_black_scholes_merton]:
+                def fn(i=0):
+                    kernel(type, S, 50, 0.02, 0.25, 1)
+
+                rows.append({'stage': kernel.__name__, 'type': type, 'n': n * n, **measure(fn, repeat, n * n)})
+    return rows
+
+
+def bench_higher_order(repeat, sizes):
+    # Marginal cost of each higher-order greek over the first-order pass, then of all of them at once
+    rows = []
+    for n in sizes:
+        S = np.linspace(10, 100, n * n)
+        base = None
+        for greeks in [[]] + [[greek] for greek in HIGHER_ORDER_GREEKS] + [HIGHER_ORDER_GREEKS]:
+            def fn(i=0):
+                black_scholes_merton('call', S, 50, 0.02, 0.25, 1, GREEKS + greeks)
+
+            row = measure(fn, repeat, n * n, memory=False)
+            base = base or row['p50_ms']
+            stage = 'greeks+' + ('all' if len(greeks) > 1 else greeks[0] if greeks else 'none')
+            rows.append({'stage': stage, 'type': 'call', 'n': n * n, **row, 'marginal_ms': row['p50_ms'] - base})
+    return rows
+
+
+def bench_lattice(repeat, sizes):
+    # American surfaces on the Leisen-Reimer lattice, with and without Richardson extrapolation
+    rows = []
+    for n in [n for n in sizes if n <= LATTICE_MAX_N]:
+        S = np.linspace(10, 100, n)[:, np.newaxis]
+        T = np.linspace(0.1, 3, n)[np.newaxis, :]
+        for richardson in [False, True]:
+            def fn(i=0):
+                binomial_lattice('put', S, 50, 0.02, 0.25 + i * 1e-9, T, richardson=richardson)
+
+            stage = 'lattice+richardson' if richardson else 'lattice'
+            rows.append({'stage': stage, 'type': 'put', 'n': n * n,
+                         **measure(fn, max(repeat // 4, 1), n * n, memory=False)})
+    return rows
+
+
+def bench_sensitivity_2D(repeat, sizes):
+    rows = []
+    for type in TYPES:
+        for n in sizes:
+            def fn(i=0):
+                sensitivity_2D(type, None, *PARAMS_2D.values(), n2D=n)
+
+            rows.append({'stage': 'sensitivity_2D', 'type': type, 'n': n, **measure(fn, repeat, n)})
+    return rows
+
+
+def bench_sensitivity_3D(repeat, sizes):
+    rows = []
+    for type in TYPES:
+        for n in sizes:
+            def fn(i=0):
+                sensitivity_3D(type, None, *PARAMS_3D.values(), n3D=n)
+
+            rows.append({'stage': 'sensitivity_3D', 'type': type, 'n': n, **measure(fn, repeat, n * n)})
+    return rows
+
+
+def bench_adaptive(repeat):
+    # Adaptive lines and surfaces within their default budgets, against the uniform stages above
+    rows = []
+    for type in TYPES:
+        for params, sensitivity, budget in [(PARAMS_2D, sensitivity_2D, ADAPTIVE_BUDGET[1]),
+                                            (PARAMS_3D, sensitivity_3D, ADAPTIVE_BUDGET[2])]:
+            grid = sensitivity(type, None, *params.values(), budget=budget)
+            points = int(np.prod([len(axis) for axis in grid.axes]))
+
+            def fn(i=0):
+                sensitivity(type, None, *unique(params, i).values(), budget=budget)
+
+            rows.append({'stage': f'adaptive_{grid.dim}D', 'type': type, 'n': points, **measure(fn, repeat, points)})
+    return rows
+
+
+def bench_scaling(repeat, n=SCALING_N):
+    # Full 3D surfaces sharded over 1, 2, 4, ... cores: speedup is relative to the first row
+    rows = []
+    workers = sorted({min(2 ** k, PARALLEL_WORKERS) for k in range(PARALLEL_WORKERS.bit_length() + 1)})
+    base = None
+    for w in workers:
+        def fn(i=0):
+            params = unique(PARAMS_3D, i)
+            sensitivity_3D('call', None, *params.values(), n3D=n, workers=w)
+
+        row = measure(fn, max(repeat // 4, 1), n * n, memory=False)
+        base = base or row['p50_ms']
+        rows.append({'stage': f'sharded_3D x{w}', 'type': 'call', 'n': n * n, **row, 'speedup': base / row['p50_ms']})
+    return rows
+
+
+def bench_figure(repeat, sizes_2D, sizes_3D):
+    rows = []
+    for n, result in [(n, sensitivity_2D('call', 'theta', *PARAMS_2D.values(), n2D=n)) for n in sizes_2D] + \
+                     [(n, sensitivity_3D('call', 'theta', *PARAMS_3D.values(), n3D=n)) for n in sizes_3D]:
+        points = result.values.size
+
+        def fn(i=0):
+            build_figure(result, 'theta')
+
+        row = {'stage': f'build_figure_{result.dim + 1}D', 'type': 'call', 'n': n, **measure(fn, repeat, points)}
+        row['payload_bytes'] = len(to_json_plotly(build_figure(result, 'theta')))
+        rows.append(row)
+    return rows
+
+
+def bench_matrix(repeat, sizes_2D, sizes_3D):
+    rows = []
+    for n, result in [(n, sensitivity_2D('call', 'theta', *PARAMS_2D.values(), n2D=n)) for n in sizes_2D] + \
+                     [(n, sensitivity_3D('call', 'theta', *PARAMS_3D.values(), n3D=n)) for n in sizes_3D]:
+        def fn(i=0):
+            build_matrix(result)
+
+        rows.append({'stage': f'build_matrix_{result.dim + 1}D', 'type': 'call', 'n': n,
+                     **measure(fn, repeat, result.values.size)})
+    return rows
+
+
+def bench_website_output(repeat, sizes):
+    rows = []
+    for type in TYPES:
+        for n in sizes:
+            def fn(i=0):
+                website_output(type, 'theta', *unique(PARAMS_3D, i).values(), n3D=n)
+
+            rows.append({'stage': 'website_output', 'type': type, 'n': n, **measure(fn, repeat, n * n)})
+    return rows
+
+
+def graph_payload(app, type, n, params):
+    dependency = next(x for x in app.server.test_client().get('/_dash-dependencies').json
+                      if 'loading_output.children' in x['output'])
+
+    values = {'submit.n_clicks': 1, 'type.value': type, 'result.value': 'theta', 'resolution.value': n,
+              'price_switch.on': True, 'price_min.value': params['S'][0], 'price_max.value': params['S'][1],
+              'strike_switch.on': False, 'strike.value': params['K'],
+              'rf_switch.on': False, 'rf.value': params['r'],
+              'sigma_switch.on': False, 'sigma.value': params['v'],
+              'maturity_switch.on': True, 'maturity_min.value': params['T'][0], 'maturity_max.value': params['T'][1]}
+
+    def fill(dependencies):
+        return [{'id': x['id'], 'property': x['property'],
+                 'value': values.get(f"{x['id']}.{x['property']}")} for x in dependencies]
+
+    outputs = [dict(zip(['id', 'property'], x.rsplit('.', 1))) for x in dependency['output'].strip('.').split('...')]
+    return {'output': dependency['output'],
+            'outputs': outputs,
+            'inputs': fill(dependency['inputs']),
+            'state': fill(dependency['state']),
+            'changedPropIds': ['submit.n_clicks']}
+
+
+def call_graph(client, payload, timeout=120):
+    # Background callbacks answer with a job handle first, then are polled until the result is ready
+    response = client.post('/_dash-update-component', json=payload)
+    job = response.get_json()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.post('/_dash-update-component', json=payload, query_string=job)
+        if response.status_code == 200 and 'response' in (response.get_json() or {}):
+            return response
+        time.sleep(0.01)
+    raise TimeoutError('The graph callback did not finish in time')
+
+
+def bench_callback(repeat, sizes):
+    import app
+
+    client = app.server.test_client()
+    client.get('/')
+
+    rows = []
+    for type in TYPES:
+        for n in sizes:
+            def fn(i=0):
+                call_graph(client, graph_payload(app.app, type, n, unique(PARAMS_3D, i)))
+
+            row = {'stage': 'graph_callback', 'type': type, 'n': n, **measure(fn, repeat, n * n, memory=False)}
+            row['payload_bytes'] = len(call_graph(client, graph_payload(app.app, type, n, PARAMS_3D)).data)
+            rows.append(row)
+    return rows
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def compare(rows, baseline):
+    previous = {(x['stage'], x['type'], x['n']): x for x in baseline['results']}
+
+    print(f"\nComparison with {baseline['revision']} ({baseline['date']})")
+    for row in rows:
+        old = previous.get((row['stage'], row['type'], row['n']))
+        if old is None:
+            continue
+        ratio = row['p50_ms'] / old['p50_ms']
+        flag = '  REGRESSION' if ratio > 1.2 else ''
+        print(f"{row['stage']:<22} {row['type']:<5} {row['n']:>8}  {old['p50_ms']:>10.3f} -> {row['p50_ms']:>10.3f} ms"
+              f"  x{ratio:.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Option Greeks 3D pipeline across grid sizes.')
+    parser.add_argument('--n2D', type=int, nargs='+', default=N2D_VALUES)
+    parser.add_argument('--n3D', type=int, nargs='+', default=N3D_VALUES)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-callback', action='store_true', help='skip the end-to-end graph() callback')
+    parser.add_argument('--output', default=None, help='save the results as a JSON baseline')
+    parser.add_argument('--compare', default=None, help='JSON baseline to compare the results with')
+    args = parser.parse_args()
+
+    stages = [lambda: bench_kernel(args.repeat, args.n3D),
+              lambda: bench_higher_order(args.repeat, args.n3D),
+              lambda: bench_lattice(args.repeat, args.n3D),
+              lambda: bench_sensitivity_2D(args.repeat, args.n2D),
+              lambda: bench_sensitivity_3D(args.repeat, args.n3D),
+              lambda: bench_scaling(args.repeat),
+              lambda: bench_adaptive(args.repeat),
+              lambda: bench_figure(args.repeat, args.n2D, args.n3D),
+              lambda: bench_matrix(args.repeat, args.n2D, args.n3D),
+              lambda: bench_website_output(args.repeat, args.n3D)]
+    if not args.no_callback:
+        stages.append(lambda: bench_callback(max(args.repeat // 4, 1), args.n3D))
+
+    print(f"{'stage':<22} {'type':<5} {'n':>8} {'p50 ms':>10} {'p99 ms':>10} {'points/s':>12} {'peak MB':>9}")
+    rows = []
+    for stage in stages:
+        for row in stage():
+            peak = row['peak_memory_bytes']
+            print(f"{row['stage']:<22} {row['type']:<5} {row['n']:>8} {row['p50_ms']:>10.3f} {row['p99_ms']:>10.3f} "
+                  f"{row['points_per_sec']:>12.3g} {'-' if peak is None else f'{peak / 2 ** 20:9.2f}':>9}")
+            rows.append(row)
+
+    print('\nMarginal cost of the higher-order greeks')
+    for row in rows:
+        if 'marginal_ms' in row and row['stage'] != 'greeks+none':
+            print(f"{row['stage']:<22} {row['n']:>8} {row['marginal_ms']:>+10.3f} ms")
+
+    print(f'\nScaling of the sharded 3D surface ({PARALLEL_WORKERS} cores available)')
+    for row in rows:
+        if 'speedup' in row:
+            print(f"{row['stage']:<22} {row['n']:>8} {row['speedup']:>10.2f}x")
+
+    if args.compare:
+        with open(os.path.join(CWD, args.compare)) as f:
+            compare(rows, json.load(f))
+
+    if args.output:
+        baseline = {'revision': git_revision(),
+                    'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'results': rows}
+        with open(os.path.join(CWD, args.output), 'w') as f:
+            json.dump(baseline, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,102 +1,295 @@
-from math import log, exp, pow, sqrt
+from functools import partial
+from math import pi, sqrt
 
 import numpy as np
-import pandas as pd
-from scipy.stats import norm
+from scipy.special import ndtr
 
-from utils import *
+from constants import *
+from adaptive import adaptive_grid
+from parallel import evaluate_sharded
 
+VARIABLES_LOOKUP = ['Underlying price (S)', 'Strike (K)', 'Risk-free (r)', 'Volatility (σ)', 'Maturity (T)']
 
-def call_black_scholes_merton(*args):
-    S, K, r, volatility, T = args[0]
+GREEKS = ['price', 'delta', 'theta', 'gamma', 'vega', 'rho']
+# Only computed when asked for, from the same d1/d2/n(d1) as the first-order greeks
+HIGHER_ORDER_GREEKS = ['vanna', 'volga', 'charm', 'speed', 'color', 'zomma']
+ALL_GREEKS = GREEKS + HIGHER_ORDER_GREEKS
 
-    d1 = (log(S / K) + (r + pow(volatility, 2) / 2) * T) / (volatility * sqrt(T))
-    d2 = d1 - volatility * sqrt(T)
 
-    Nd1 = norm.cdf(d1)
-    Nd2 = norm.cdf(d2)
+class Grid:
+    # Array-backed result of a sensitivity sweep: `values` holds one ndarray per greek
+    # (or a single ndarray once a greek is selected), sampled over one axis per swept variable.
 
-    Nd1_ = norm.pdf(d1)
+    # `source` is the (type, variables, kernel) of a lattice grid, which can be recomputed over a narrower range.
 
-    c_greeks = {'price': S * Nd1 - K * exp(-r * T) * Nd2,
-                'delta': Nd1,
-                'theta': - (S * Nd1_ * volatility) / (2 * sqrt(T)) - r * K * exp(-r * T) * Nd2,
-                'gamma': Nd1_ / (S * volatility * sqrt(T)),
-                'vega': S * sqrt(T) * Nd1_,
-                'rho': K * T * exp(-r * T) * Nd2
-                }
+    def __init__(self, values, axes, labels, source=None):
+        self.values = values
+        self.axes = axes
+        self.labels = labels
+        self.source = source
 
-    return c_greeks
+    @property
+    def dim(self):
+        return len(self.axes)
 
+    def select(self, on):
+        return Grid(self.values[on], self.axes, self.labels, self.source)
 
-def put_black_scholes_merton(*args):
-    S, K, r, volatility, T = args[0]
 
-    d1 = (log(S / K) + (r + pow(volatility, 2) / 2) * T) / (volatility * sqrt(T))
-    d2 = d1 - volatility * sqrt(T)
+def black_scholes_merton(type, S, K, r, volatility, T, greeks=GREEKS, q=0):
+    # Every argument may be a scalar or an ndarray: they are broadcast against each other,
+    # so a whole grid is priced in one pass and each greek comes back with the grid's shape.
+    # The first-order greeks are always returned, the higher-order ones listed in `greeks` are added.
+    # q is the continuous yield of the underlying (dividends, foreign rate), see models.py.
+    sqrt_T = np.sqrt(T)
+    vol_sqrt_T = volatility * sqrt_T
 
-    Nd1 = norm.cdf(-d1)
-    Nd2 = norm.cdf(-d2)
+    d1 = (np.log(S / K) + (r - q + volatility ** 2 / 2) * T) / vol_sqrt_T
+    d2 = d1 - vol_sqrt_T
 
-    Nd1_ = norm.pdf(d1)
+    Nd1_ = np.exp(-d1 ** 2 / 2) / sqrt(2 * pi)
+    if type == 'call':
+        return black_scholes_merton_greeks(type, S, K, r, volatility, T, d1, d2, ndtr(d1), ndtr(d2), Nd1_, greeks, q)
+    return black_scholes_merton_greeks(type, S, K, r, volatility, T, d1, d2, ndtr(-d1), ndtr(-d2), Nd1_, greeks, q)
 
-    c_greeks = {'price': K * exp(-r * T) * Nd2 - S * Nd1,
-                'delta': -Nd1,
-                'theta': - (S * Nd1_ * volatility) / (2 * sqrt(T)) + r * K * exp(-r * T) * Nd2,
-                'gamma': Nd1_ / (S * volatility * sqrt(T)),
-                'vega': S * sqrt(T) * Nd1_,
-                'rho': -K * T * exp(-r * T) * Nd2
-                }
 
-    return c_greeks
+def black_scholes_merton_greeks(type, S, K, r, volatility, T, d1, d2, Nd1, Nd2, Nd1_, greeks=GREEKS, q=0):
+    # The greeks from d1, d2, N(±d1), N(±d2) (signed for the type) and n(d1), however these were obtained
+    sqrt_T = np.sqrt(T)
+    vol_sqrt_T = volatility * sqrt_T
+    discount = K * np.exp(-r * T)
 
+    if np.any(q):
+        # Every term in N(d1) or n(d1) is on the underlying, which loses its yield until maturity
+        carry = np.exp(-q * T)
+        Nd1 = carry * Nd1
+        Nd1_ = carry * Nd1_
 
-def sensitivity_2D(type, on, S, K, r, volatility, T, n2D=500):
-    variables_lookup = ['Underlying price (S)', 'Strike (K)', 'Risk-free (r)', 'Volatility (σ)', 'Maturity (T)']
-    variables = [S, K, r, volatility, T]
+    gamma = Nd1_ / (S * vol_sqrt_T)
+    vega = S * sqrt_T * Nd1_
 
-    sens_variable = None
-    for i, variable in enumerate(variables):
-        if isinstance(variable, tuple):
-            sens_variable = [i, variable, variables_lookup[i]]
-
-    Y = []
-    i = sens_variable[0]
-    X = np.linspace(sens_variable[1][0], sens_variable[1][1], n2D)
-    for x in X:
-        variables[i] = x
-        if type == 'call':
-            c_greeks = call_black_scholes_merton(variables)
-        else:
-            c_greeks = put_black_scholes_merton(variables)
-        Y.append(c_greeks[on])
-    return pd.DataFrame(Y, index=X), sens_variable[2]
-
-
-def sensitivity_3D(type, on, S, K, r, volatility, T, n3D=50):
-    variables_lookup = ['Underlying price (S)', 'Strike (K)', 'Risk-free (r)', 'Volatility (σ)', 'Maturity (T)']
+    if type == 'call':
+        output = {'price': S * Nd1 - discount * Nd2,
+                  'delta': Nd1,
+                  'theta': - (S * Nd1_ * volatility) / (2 * sqrt_T) - r * discount * Nd2,
+                  'gamma': gamma,
+                  'vega': vega,
+                  'rho': discount * T * Nd2
+                  }
+    else:
+        output = {'price': discount * Nd2 - S * Nd1,
+                  'delta': -Nd1,
+                  'theta': - (S * Nd1_ * volatility) / (2 * sqrt_T) + r * discount * Nd2,
+                  'gamma': gamma,
+                  'vega': vega,
+                  'rho': -discount * T * Nd2
+                  }
+    if np.any(q):
+        output['theta'] = output['theta'] + q * S * output['delta']
+
+    # Only charm depends on the type, through q * delta: without a yield the higher-order greeks of
+    # calls and puts are the same. charm and color are the decay of delta and gamma over calendar time, like theta.
+    if 'vanna' in greeks:
+        output['vanna'] = -Nd1_ * d2 / volatility
+    if 'volga' in greeks:
+        output['volga'] = vega * d1 * d2 / volatility
+    if 'charm' in greeks or 'color' in greeks:
+        drift = (2 * (r - q) * T - d2 * vol_sqrt_T) / (2 * T * vol_sqrt_T)
+        if 'charm' in greeks:
+            output['charm'] = q * output['delta'] - Nd1_ * drift if np.any(q) else -Nd1_ * drift
+        if 'color' in greeks:
+            output['color'] = gamma * (q + 1 / (2 * T) + drift * d1)
+    if 'speed' in greeks:
+        output['speed'] = -gamma / S * (d1 / vol_sqrt_T + 1)
+    if 'zomma' in greeks:
+        output['zomma'] = gamma * (d1 * d2 - 1) / volatility
+
+    return output
+
+
+def black_scholes_merton_batch(types, S, K, r, volatility, T, greeks=GREEKS):
+    # Contracts of both types in one batch: each type is priced on its own rows, in a single vectorized call
+    output = {greek: np.full(len(types), np.nan) for greek in greeks}
+
+    for type in ['call', 'put']:
+        mask = types == type
+        if mask.any():
+            values = black_scholes_merton(type, S[mask], K[mask], r[mask], volatility[mask], T[mask], greeks)
+            for greek in greeks:
+                output[greek][mask] = values[greek]
+
+    return output
+
+
+# The columns of a batch of contracts, besides their type: the API and the option chain CLI both read them
+FIELDS = ['S', 'K', 'r', 'sigma', 'T']
+
+
+class BatchError(ValueError):
+    # An invalid batch of contracts: a 400 from the API, an error message from the CLI
+    pass
+
+
+def parse_greeks(greeks):
+    if greeks is None:
+        return GREEKS
+    if isinstance(greeks, str):
+        greeks = greeks.split(',')
+    if not isinstance(greeks, list) or not all(isinstance(greek, str) for greek in greeks):
+        raise BatchError('"greeks" must be a list of greek names')
+    if not greeks:
+        raise BatchError('"greeks" must name at least one greek')
+    unknown = set(greeks) - set(ALL_GREEKS)
+    if unknown:
+        raise BatchError(f'Unknown greeks {sorted(unknown)}, expected a subset of {ALL_GREEKS}')
+    return list(greeks)
+
+
+def call_black_scholes_merton(*args):
+    S, K, r, volatility, T = args[0]
+    return black_scholes_merton('call', S, K, r, volatility, T)
+
+
+def put_black_scholes_merton(*args):
+    S, K, r, volatility, T = args[0]
+    return black_scholes_merton('put', S, K, r, volatility, T)
+
+
+def evaluate(type, S, K, r, volatility, T, time_forward=0, kernel=black_scholes_merton, greeks=GREEKS):
+    # `type` is either 'call'/'put' or a Portfolio, which aggregates the greeks of its legs.
+    # time_forward only matters for the legs with their own maturity: T is already the panel maturity.
+    # `kernel` prices a single type, e.g. black_scholes_merton or atlas.atlas_black_scholes_merton.
+    if isinstance(type, str):
+        return kernel(type, S, K, r, volatility, T, greeks)
+    return type.greeks(S, K, r, volatility, T, time_forward=time_forward, greeks=greeks, kernel=kernel)
+
+
+def sensitivity_variables(S, K, r, volatility, T):
     variables = [S, K, r, volatility, T]
 
     sens_variables = []
     for i, variable in enumerate(variables):
         if isinstance(variable, tuple):
-            sens_variables.append([i, variable, variables_lookup[i]])
+            sens_variables.append([i, variable, VARIABLES_LOOKUP[i]])
+
+    return variables, sens_variables
+
+
+def sensitivity_points(type, variables, swept, greeks, kernel, axes):
+    # Every greek on the product of `axes`, the values of the variables at the indices `swept`
+    variables = list(variables)
+    for k, (i, axis) in enumerate(zip(swept, axes)):
+        variables[i] = axis.reshape([-1 if d == k else 1 for d in range(len(axes))])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = evaluate(type, *variables, kernel=kernel, greeks=greeks)
+    shape = tuple(len(axis) for axis in axes)
+    return {greek: np.broadcast_to(values[greek], shape) for greek in ALL_GREEKS if greek in values and greek in greeks}
+
+
+def sensitivity_lattice(type, S, K, r, volatility, T, n, kernel=black_scholes_merton, workers=1):
+    # Every greek on the canonical lattice of tiles.py: about n points per swept variable, inside its range,
+    # from the tiles cached by earlier requests with the same fixed values
+    # Imported here: tiles.py opens the shared cache, which the kernels alone do not need
+    from tiles import tiled_grid
+
+    variables, sens_variables = sensitivity_variables(S, K, r, volatility, T)
+    swept = [i for i, bounds, label in sens_variables]
+
+    fixed = [None if i in swept else variable for i, variable in enumerate(variables)]
+    context = (type, fixed, swept, getattr(kernel, '__name__', None) or repr(kernel))
+    task = partial(sensitivity_points, type, variables, swept, ALL_GREEKS, kernel)
+    values, axes = tiled_grid(task, context, [bounds for i, bounds, label in sens_variables], n, workers)
+    return Grid(values, axes, [label for i, bounds, label in sens_variables], source=(type, variables, kernel))
+
+
+def sensitivity_adaptive(type, on, S, K, r, volatility, T, budget=None, kernel=black_scholes_merton):
+    # Non-uniform axes refined where the greeks curve most, see adaptive.py: with `on`, only that greek counts
+    variables, sens_variables = sensitivity_variables(S, K, r, volatility, T)
+    swept = [i for i, bounds, label in sens_variables]
+
+    task = partial(sensitivity_points, type, variables, swept, ALL_GREEKS if on is None else [on], kernel)
+    values, axes = adaptive_grid(task, [bounds for i, bounds, label in sens_variables], budget)
+    return Grid(values if on is None else values[on], axes, [label for i, bounds, label in sens_variables])
+
+
+def sensitivity_2D(type, on, S, K, r, volatility, T, n2D=N2D, kernel=black_scholes_merton, lattice=False, budget=None):
+    # With a budget, the line is sampled adaptively within that many points, see adaptive.py
+    if budget:
+        return sensitivity_adaptive(type, on, S, K, r, volatility, T, budget, kernel)
+    if lattice and on is None:
+        return sensitivity_lattice(type, S, K, r, volatility, T, n2D, kernel)
+
+    variables, sens_variables = sensitivity_variables(S, K, r, volatility, T)
+
+    i = sens_variables[0][0]
+    X = np.linspace(sens_variables[0][1][0], sens_variables[0][1][1], n2D)
+    variables[i] = X
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        greeks = evaluate(type, *variables, kernel=kernel, greeks=ALL_GREEKS if on is None else [on])
+
+    if on is None:
+        # Keep every greek the kernel gives: the surfaces share d1/d2/N(d1)/n(d1), so they come almost for free
+        values = {greek: np.broadcast_to(greeks[greek], X.shape) for greek in ALL_GREEKS if greek in greeks}
+    else:
+        values = np.broadcast_to(greeks[on], X.shape)
+    return Grid(values, [X], [sens_variables[0][2]])
+
+
+def sensitivity_rows(type, variables, i, j, X, Y, greeks, kernel, start, stop):
+    # The rows start:stop of a 3D grid, with every greek at the shape of the tile
+    variables = list(variables)
+    variables[i] = X[start:stop, np.newaxis]
+    variables[j] = Y[np.newaxis, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = evaluate(type, *variables, kernel=kernel, greeks=greeks)
+    return {greek: np.broadcast_to(values[greek], (stop - start, len(Y))) for greek in ALL_GREEKS
+            if greek in values and greek in greeks}
+
+
+def sensitivity_3D(type, on, S, K, r, volatility, T, n3D=N3D, kernel=black_scholes_merton, workers=1, lattice=False,
+                   budget=None):
+    if budget:
+        return sensitivity_adaptive(type, on, S, K, r, volatility, T, budget, kernel)
+    if lattice and on is None:
+        return sensitivity_lattice(type, S, K, r, volatility, T, n3D, kernel, workers)
+
+    variables, sens_variables = sensitivity_variables(S, K, r, volatility, T)
 
-    sensitivity_matrix = []
     i = sens_variables[0][0]
     j = sens_variables[1][0]
     X = np.linspace(sens_variables[0][1][0], sens_variables[0][1][1], n3D)
     Y = np.linspace(sens_variables[1][1][0], sens_variables[1][1][1], n3D)
-    for x in X:
-        variables[i] = x
-        row = []
-        for y in Y:
-            variables[j] = y
-            if type == 'call':
-                c_greeks = call_black_scholes_merton(variables)
-            else:
-                c_greeks = put_black_scholes_merton(variables)
-            row.append(c_greeks[on])
-        sensitivity_matrix.append(row)
-    output = pd.DataFrame(sensitivity_matrix, index=X, columns=Y)
-    return output, sens_variables[0][2], sens_variables[1][2]
+
+    # Large grids are split in blocks of rows over `workers` processes, see parallel.py
+    task = partial(sensitivity_rows, type, variables, i, j, X, Y, ALL_GREEKS if on is None else [on], kernel)
+    greeks = evaluate_sharded(task, n3D, n3D * n3D, workers)
+
+    if on is None:
+        values = greeks
+    else:
+        values = greeks[on]
+    return Grid(values, [X, Y], [sens_variables[0][2], sens_variables[1][2]])
+
+
+def sensitivity_4D(type, on, S, K, r, volatility, T, n3D=N3D, frames=ANIMATION_FRAMES, kernel=black_scholes_merton):
+    # Surfaces over the first two swept variables, one per value of the third:
+    # the whole (n3D x n3D x frames) tensor comes from a single broadcast evaluation
+    variables, sens_variables = sensitivity_variables(S, K, r, volatility, T)
+
+    shape = (n3D, n3D, frames)
+    axes = []
+    for k, (i, bounds, label) in enumerate(sens_variables):
+        axes.append(np.linspace(bounds[0], bounds[1], shape[k]))
+        variables[i] = axes[k].reshape([-1 if d == k else 1 for d in range(3)])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        greeks = evaluate(type, *variables, kernel=kernel, greeks=ALL_GREEKS if on is None else [on])
+
+    if on is None:
+        values = {greek: np.broadcast_to(greeks[greek], shape) for greek in ALL_GREEKS if greek in greeks}
+    else:
+        values = np.broadcast_to(greeks[on], shape)
+    return Grid(values, axes, [label for i, bounds, label in sens_variables])
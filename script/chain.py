@@ -0,0 +1,197 @@
+import argparse
+import queue
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from black_scholes_functions import FIELDS, BatchError, black_scholes_merton_batch, parse_greeks
+from constants import CSV_FLOAT_FORMAT
+
+try:
+    # Optional: only needed to read or write Parquet files
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+CHAIN_CHUNK_ROWS = 100_000
+# Chunks buffered between reading, pricing and writing: with the chunks in flight in the workers,
+# this is all that is ever in memory, whatever the size of the file
+CHAIN_QUEUE_SIZE = 2
+REPORT_SECONDS = 5
+
+# An option chain is a CSV or Parquet file with the columns type, S, K, r, sigma, T (any others are kept as is).
+# It goes through a pipeline of generators: a thread reads the chunks, another prices them (or hands them to a
+# process pool), and the main thread writes them, so that I/O overlaps with the computation. CSV chunks are
+# formatted along with their pricing, so the workers share that cost too.
+
+
+def is_parquet(path):
+    return path.endswith(('.parquet', '.pq'))
+
+
+def require_parquet():
+    if pq is None:
+        raise BatchError('Parquet files need pyarrow: pip install pyarrow')
+
+
+def read_chunks(path, chunk_rows=CHAIN_CHUNK_ROWS):
+    if is_parquet(path):
+        require_parquet()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={'type': str})
+
+
+def price_chunk(frame, greeks):
+    missing = [field for field in ['type'] + FIELDS if field not in frame]
+    if missing:
+        raise BatchError(f'Missing columns {missing}, an option chain needs type, {", ".join(FIELDS)}')
+
+    types = frame['type'].to_numpy(dtype=str)
+    values = [frame[field].to_numpy(dtype=float) for field in FIELDS]
+    # Invalid contracts get NaN greeks rather than stopping the whole file
+    with np.errstate(all='ignore'):
+        output = black_scholes_merton_batch(types, *values, greeks=greeks)
+    return frame.assign(**output)
+
+
+def process_chunk(chunk, greeks, csv):
+    # A numbered chunk -> its number of rows and its priced frame, or its CSV text (with the header if it is first)
+    index, frame = chunk
+    frame = price_chunk(frame, greeks)
+    if csv:
+        return len(frame), frame.to_csv(header=index == 0, index=False, float_format=CSV_FLOAT_FORMAT)
+    return len(frame), frame
+
+
+class CsvWriter:
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+
+    def write(self, text):
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    # One row group per chunk, with the schema of the first one
+
+    def __init__(self, path):
+        require_parquet()
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def background(iterator, size=CHAIN_QUEUE_SIZE):
+    # Runs an iterator in a thread, at most `size` items ahead of the consumer
+    items = queue.Queue(size)
+    done = object()
+
+    def run():
+        try:
+            for item in iterator:
+                items.put((item, None))
+            items.put((done, None))
+        except BaseException as e:
+            items.put((None, e))
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+def ordered_map(pool, fn, iterator, window):
+    # pool.map, with at most `window` chunks submitted ahead of the results, in the order of the input
+    pending = deque()
+    for item in iterator:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def peak_memory():
+    # Peak resident memory of this process and of its largest worker, in MiB (ru_maxrss is in KiB on Linux)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 2 ** 10
+
+
+def price_chain(input, output, greeks, chunk_rows=CHAIN_CHUNK_ROWS, workers=1, report=sys.stderr):
+    process = partial(process_chunk, greeks=greeks, csv=not is_parquet(output))
+    chunks = background(enumerate(read_chunks(input, chunk_rows)))
+    writer = ParquetWriter(output) if is_parquet(output) else CsvWriter(output)
+
+    start = last = time.perf_counter()
+    rows = 0
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        if pool is None:
+            processed = background(map(process, chunks))
+        else:
+            processed = ordered_map(pool, process, chunks, workers * CHAIN_QUEUE_SIZE)
+
+        for size, chunk in processed:
+            writer.write(chunk)
+            rows += size
+            now = time.perf_counter()
+            if report is not None and now - last > REPORT_SECONDS:
+                print(f'{rows:,} rows, {rows / (now - start):,.0f} rows/s', file=report)
+                last = now
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0,
+            'peak_memory_mib': peak_memory()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Price an option chain file, chunk by chunk.')
+    parser.add_argument('input', help='CSV or Parquet file with the columns type, ' + ', '.join(FIELDS))
+    parser.add_argument('output', help='CSV or Parquet file (by its extension) with the greeks appended')
+    parser.add_argument('--greeks', default=None, help='comma-separated greeks, the first-order ones by default')
+    parser.add_argument('--chunk-rows', type=int, default=CHAIN_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=1, help='price the chunks on this many processes')
+    args = parser.parse_args()
+
+    try:
+        stats = price_chain(args.input, args.output, parse_greeks(args.greeks), args.chunk_rows, args.workers)
+    except BatchError as e:
+        parser.exit(1, f'error: {e}\n')
+
+    print(f"{stats['rows']:,} rows in {stats['seconds']:.2f}s: {stats['rows_per_sec']:,.0f} rows/s, "
+          f"peak memory {stats['peak_memory_mib']:.0f} MiB", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,3 +6,39 @@ TABS_HEIGHT = 50
 
 HEIGHT = HEADER_HEIGHT + MAIN_HEIGHT + HELP_HEIGHT
 GRAPH_HEIGHT = MAIN_HEIGHT - TABS_HEIGHT - 20
+
+N2D = 500
+N3D = 50
+
+RESOLUTIONS = [50, 100, 200, 300, 500]
+# The resolution that samples lines and surfaces adaptively, within adaptive.ADAPTIVE_BUDGET points
+ADAPTIVE = 'adaptive'
+# Sample the full grids on the canonical lattice of tiles.py, reusing the tiles of earlier requests: a range is
+# then covered by about n lattice points inside it, instead of np.linspace(min, max, n). Only for the closed-form
+# models of models.CLOSED_FORM: whole tiles are evaluated, which the lattice and Monte Carlo models cannot afford.
+USE_LATTICE = True
+
+# Three swept variables give surfaces over the first two, animated over ANIMATION_FRAMES values of the third.
+# The resolution of the surfaces is lowered so that the whole tensor stays within ANIMATION_MAX_POINTS:
+# with every greek kept, the cached grid is then about as large as a 500 x 500 surface (70 x 70 x 50).
+ANIMATION_FRAMES = 50
+ANIMATION_MAX_POINTS = 250_000
+PROGRESSIVE_STEPS = [12, 25, 50, 100, 200]
+
+# Figure arrays are rounded to FIGURE_PRECISION significant digits of their range (max - min), steps of 1e-5
+# of the height of the plot; None sends them with the ~7 significant digits of a float32.
+# TYPED_ARRAYS sends them as base64 float32 typed arrays, which needs plotly.js >= 2.28.
+FIGURE_PRECISION = 5
+FLOAT32_DIGITS = 7
+TYPED_ARRAYS = False
+
+MIN_VOLATILITY = 1e-4
+MIN_MATURITY = 1e-6
+
+# Read N(d1), N(d2), n(d1) from the memory-mapped atlas (see atlas.py) instead of evaluating them:
+# off by default, since the interpolation is only accurate to ~4e-6 and not faster than NumPy's own ndtr/exp.
+USE_ATLAS = False
+
+# Floats in CSV files (option chains, grid exports): formatting them dominates the cost, and 12 significant
+# digits are plenty for greeks
+CSV_FLOAT_FORMAT = '%.12g'
@@ -0,0 +1,104 @@
+import io
+import struct
+
+import numpy as np
+import pandas as pd
+
+from constants import CSV_FLOAT_FORMAT
+
+try:
+    # Optional: only needed for Parquet exports
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_FORMATS = ['csv', 'npy'] + (['parquet'] if pq is not None else [])
+EXPORT_TYPES = {'csv': 'text/csv', 'npy': 'application/x-npy', 'parquet': 'application/vnd.apache.parquet'}
+
+# A cached Grid is exported in long format, one row per point of the grid and one column per swept variable
+# and per greek. The rows are produced a few lines of the first axis at a time, so that only one chunk
+# is ever formatted in memory next to the grid itself.
+
+
+def grid_columns(result):
+    return list(result.labels) + list(result.values)
+
+
+def grid_chunks(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    shape = tuple(len(axis) for axis in result.axes)
+    inner = int(np.prod(shape[1:]))
+    step = max(1, chunk_rows // inner)
+    for start in range(0, shape[0], step):
+        stop = min(start + step, shape[0])
+        axes = np.meshgrid(result.axes[0][start:stop], *result.axes[1:], indexing='ij')
+        columns = {label: axis.ravel() for label, axis in zip(result.labels, axes)}
+        for greek, values in result.values.items():
+            columns[greek] = np.broadcast_to(values, shape)[start:stop].ravel()
+        yield columns
+
+
+def stream_csv(result):
+    for i, columns in enumerate(grid_chunks(result)):
+        yield pd.DataFrame(columns).to_csv(header=i == 0, index=False, float_format=CSV_FLOAT_FORMAT).encode()
+
+
+def npy_header(dtype, shape):
+    # Version 3.0 of the format, whose header is utf-8: the columns are named after the axes, e.g. Volatility (σ)
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape}).encode()
+    header += b' ' * (-(len(header) + 13) % 64) + b'\n'
+    return np.lib.format.magic(3, 0) + struct.pack('<I', len(header)) + header
+
+
+def stream_npy(result):
+    # A structured array, with one field per column
+    dtype = np.dtype([(name, np.float64) for name in grid_columns(result)])
+    yield npy_header(dtype, (int(np.prod([len(axis) for axis in result.axes])),))
+
+    for columns in grid_chunks(result):
+        chunk = np.empty(len(columns[result.labels[0]]), dtype)
+        for name, column in columns.items():
+            chunk[name] = column
+        yield chunk.tobytes()
+
+
+class StreamSink(io.RawIOBase):
+    # A write-only file that hands over what was written to it so far, for pyarrow to write a streamed response
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(result):
+    # One row group per chunk
+    sink = StreamSink()
+    writer = None
+    for columns in grid_chunks(result):
+        table = pa.table(columns)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+STREAMS = {'csv': stream_csv, 'npy': stream_npy, 'parquet': stream_parquet}
@@ -0,0 +1,109 @@
+import numpy as np
+
+from black_scholes_functions import black_scholes_merton_batch
+
+IV_TOLERANCE = 1e-8
+# A price within IV_TOLERANCE only pins sigma down to about IV_TOLERANCE / vega: quotes where that exceeds
+# IV_SIGMA_TOLERANCE (deep out of the money, or very short-dated) are flagged rather than reported as solved
+IV_SIGMA_TOLERANCE = 1e-4
+IV_BRACKET = (1e-4, 5.0)
+NEWTON_ITERATIONS = 20
+BISECTION_ITERATIONS = 100
+
+
+def no_arbitrage_bounds(types, S, K, r, T):
+    discount = K * np.exp(-r * T)
+    is_call = types == 'call'
+    lower = np.where(is_call, np.maximum(S - discount, 0), np.maximum(discount - S, 0))
+    upper = np.where(is_call, S, discount)
+    return lower, upper
+
+
+def model_price(types, S, K, r, volatility, T, greeks=('price',)):
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return black_scholes_merton_batch(types, S, K, r, volatility, T, greeks=list(greeks))
+
+
+def implied_volatility(types, price, S, K, r, T, tol=IV_TOLERANCE, bracket=IV_BRACKET,
+                       newton_iterations=NEWTON_ITERATIONS, bisection_iterations=BISECTION_ITERATIONS,
+                       sigma_tol=IV_SIGMA_TOLERANCE):
+    # Newton steps on every quote at once, using the kernel's vega; the quotes that leave the bracket,
+    # hit a flat vega or do not converge fall back to a vectorized bisection over the bracket.
+    # A root whose vega is too flat to identify sigma within sigma_tol is not converged, with method 'flat_vega'.
+    price, S, K, r, T = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [price, S, K, r, T]])
+    shape = price.shape
+    types = np.broadcast_to(np.asarray(types), shape).ravel()
+    price, S, K, r, T = [x.ravel() for x in [price, S, K, r, T]]
+    low, high = bracket
+
+    n = price.size
+    sigma = np.full(n, np.nan)
+    converged = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=int)
+    method = np.full(n, '', dtype='<U9')
+
+    lower, upper = no_arbitrage_bounds(types, S, K, r, T)
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(price) & (S > 0) & (K > 0) & (T > 0) & (price > lower) & (price < upper)
+
+    # Manaster-Koehler starting point: Newton converges monotonically from it for most quotes
+    active = np.flatnonzero(valid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = np.sqrt(2 * np.abs(np.log(S[active] / K[active]) + r[active] * T[active]) / T[active])
+    sigma[active] = np.clip(np.where(guess > 0, guess, 0.2), low, high)
+
+    for iteration in range(1, newton_iterations + 1):
+        if active.size == 0:
+            break
+        idx = active
+        greeks = model_price(types[idx], S[idx], K[idx], r[idx], sigma[idx], T[idx], greeks=('price', 'vega'))
+        diff = greeks['price'] - price[idx]
+
+        done = np.abs(diff) < tol
+        converged[idx[done]] = True
+        method[idx[done]] = 'newton'
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = sigma[idx] - diff / greeks['vega']
+        keep = ~done & np.isfinite(step) & (step > low) & (step < high)
+        sigma[idx[keep]] = step[keep]
+        iterations[idx] = iteration
+        active = idx[keep]
+
+    failed = np.flatnonzero(valid & ~converged)
+    if failed.size:
+        a = np.full(failed.size, low)
+        b = np.full(failed.size, high)
+        args = types[failed], S[failed], K[failed], r[failed]
+
+        # The price is increasing in sigma: quotes outside [price(low), price(high)] have no root in the bracket
+        inside = ((model_price(*args, a, T[failed])['price'] <= price[failed]) &
+                  (model_price(*args, b, T[failed])['price'] >= price[failed]))
+
+        for iteration in range(1, bisection_iterations + 1):
+            mid = (a + b) / 2
+            diff = model_price(*args, mid, T[failed])['price'] - price[failed]
+            a = np.where(diff < 0, mid, a)
+            b = np.where(diff < 0, b, mid)
+            if (np.abs(diff[inside]) < tol).all():
+                break
+
+        done = inside & (np.abs(diff) < tol)
+        sigma[failed] = np.where(inside, mid, np.nan)
+        converged[failed] = done
+        method[failed[done]] = 'bisection'
+        iterations[failed] += iteration
+
+    solved = np.flatnonzero(converged)
+    vega = model_price(types[solved], S[solved], K[solved], r[solved], sigma[solved], T[solved],
+                       greeks=('price', 'vega'))['vega']
+    with np.errstate(divide='ignore'):
+        flat = ~(tol / vega <= sigma_tol)
+    converged[solved[flat]] = False
+    method[solved[flat]] = 'flat_vega'
+
+    sigma[~converged] = np.nan
+    return {'sigma': sigma.reshape(shape),
+            'converged': converged.reshape(shape),
+            'iterations': iterations.reshape(shape),
+            'method': method.reshape(shape)}
@@ -4,6 +4,7 @@ from dash.html import Div, P, Button
 import dash_daq as daq
 
 from constants import *
+from models import MODELS
 
 price = [P('Underlying price (S)',
            style={'font-family': 'Arial', 'font-size': '15px', 'position': 'relative', 'top': 'px', 'margin': 'auto'}),
@@ -167,13 +168,37 @@ button_style_off = {'position': 'relative', 'top': '450px',
                     'border': 'none', 'border-radius': '4px', 'height': '40px', 'width': '80%', 'padding': '0px 45px',
                     'font-size': '20px', 'background-color': '#008CBA', 'color': 'white'}
 
+positions = dcc.Textarea(
+    id='positions',
+    placeholder='Portfolio legs as type,K,T,quantity separated by ";" (leave K or T empty to use the panel values), '
+                'e.g. call,60,1,10; put,40,,-5',
+    style={'display': 'none'}
+)
+
+positions_style = {'position': 'absolute', 'top': '568px', 'left': '1.5%', 'width': '11.8%', 'height': '34px',
+                   'font-size': '12px', 'resize': 'none'}
+
+scenarios = dcc.Textarea(
+    id='scenarios',
+    value='spot=-30:30; vol=-0.1:0.1; rate=0; days=0',
+    placeholder='Shocks as name=value or name=min:max: spot (%), vol, rate, days',
+    style={'display': 'none'}
+)
+
+scenarios_style = {'position': 'absolute', 'top': '568px', 'left': '14.2%', 'width': '11.8%', 'height': '34px',
+                   'font-size': '12px', 'resize': 'none'}
+
+yield_style = {'position': 'absolute', 'top': '112px', 'left': '23.5%', 'width': '3.5%', 'height': '30px',
+               'textAlign': 'center', 'font-size': '15px'}
+
 variables_menu = [
 
     dcc.Dropdown(
         id="type",
         options=[
             {"label": "Call Option", "value": "call"},
-            {"label": "Put Option", "value": "put"}],
+            {"label": "Put Option", "value": "put"},
+            {"label": "Portfolio", "value": "portfolio"}],
         placeholder="Select the option type",
         style={'position': 'relative', 'top': '15px', 'padding': '0px 35px', 'font-size': '15px'}),
 
@@ -186,10 +211,41 @@ variables_menu = [
             {"label": "Gamma", "value": "gamma"},
             {"label": "Vega", "value": "vega"},
             {"label": "Rho", "value": "rho"},
+            {"label": "Vanna", "value": "vanna"},
+            {"label": "Volga", "value": "volga"},
+            {"label": "Charm", "value": "charm"},
+            {"label": "Speed", "value": "speed"},
+            {"label": "Color", "value": "color"},
+            {"label": "Zomma", "value": "zomma"},
+            {"label": "Scenario P&L", "value": "pnl"},
         ],
         placeholder="Select which option's greek to show",
         style={'position': 'relative', 'top': '25px', 'padding': '0px 35px', 'font-size': '15px'}),
 
+    dcc.Dropdown(
+        id="resolution",
+        options=[{"label": f"3D: {n} x {n}", "value": n} for n in RESOLUTIONS] + [{"label": "Adaptive", "value": ADAPTIVE}],
+        value=N3D,
+        clearable=False,
+        style={'position': 'absolute', 'top': '112px', 'width': '12.5%', 'box-sizing': 'border-box',
+               'padding': '0px 5px 0px 35px', 'font-size': '15px'}),
+
+    dcc.Dropdown(
+        id="model",
+        options=[{"label": label, "value": name} for name, (label, kernel, yield_label) in MODELS.items()],
+        value='bsm',
+        clearable=False,
+        style={'position': 'absolute', 'top': '112px', 'left': '13%', 'width': '10.5%', 'box-sizing': 'border-box',
+               'padding': '0px 5px', 'font-size': '15px'}),
+
+    dcc.Input(
+        id='yield',
+        type='number',
+        value=0,
+        placeholder='q',
+        debounce=True,
+        style=yield_style),
+
     Div(
         children=price,
         id='price_div',
@@ -245,7 +301,11 @@ variables_menu = [
         id='submit',
         n_clicks=0,
         style=button_style
-    )
+    ),
+
+    positions,
+
+    scenarios
 ]
 
 example_button = Button(
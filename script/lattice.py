@@ -0,0 +1,129 @@
+import numpy as np
+
+from black_scholes_functions import GREEKS
+
+LATTICE_STEPS = 101
+LATTICE_METHODS = ['leisen_reimer', 'crr']
+LATTICE_MEMORY_BUDGET = 2 ** 27
+# vega and rho are central differences of the lattice price over these bumps
+VEGA_BUMP = 1e-2
+RHO_BUMP = 1e-3
+
+
+def peizer_pratt(z, n):
+    # Peizer-Pratt method 2 inversion: the binomial probability matching N(z) on n steps
+    return 0.5 + np.sign(z) * 0.5 * np.sqrt(1 - np.exp(-(z / (n + 1 / 3 + 0.1 / (n + 1))) ** 2 * (n + 1 / 6)))
+
+
+def lattice_moves(S, K, r, volatility, T, q, steps, method):
+    dt = T / steps
+    growth = np.exp((r - q) * dt)
+    if method == 'crr':
+        u = np.exp(volatility * np.sqrt(dt))
+        d = 1 / u
+        p = (growth - d) / (u - d)
+    else:
+        vol_sqrt_T = volatility * np.sqrt(T)
+        d1 = (np.log(S / K) + (r - q + volatility ** 2 / 2) * T) / vol_sqrt_T
+        p = peizer_pratt(d1 - vol_sqrt_T, steps)
+        u = growth * peizer_pratt(d1, steps) / p
+        d = (growth - p * u) / (1 - p)
+    return u, d, p
+
+
+def lattice_pass(type, S, K, r, volatility, T, q, steps, method, american):
+    # Backward induction on (points x nodes) arrays: one array operation per time step for every point at once.
+    # Returns the node values and spot prices of steps 0 to 2, for the greeks, and which points are
+    # exercised right away.
+    u, d, p = [x[:, np.newaxis] for x in lattice_moves(S, K, r, volatility, T, q, steps, method)]
+    discount = np.exp(-r * T / steps)[:, np.newaxis]
+    strike = K[:, np.newaxis]
+    sign = 1 if type == 'call' else -1
+
+    j = np.arange(steps + 1)
+    prices = S[:, np.newaxis] * u ** j * d ** (steps - j)
+    values = np.maximum(sign * (prices - strike), 0)
+
+    nodes = {}
+    exercised = np.zeros(len(S), dtype=bool)
+    for i in range(steps - 1, -1, -1):
+        values = discount * (p * values[:, 1:] + (1 - p) * values[:, :-1])
+        prices = prices[:, :-1] / d
+        if american:
+            intrinsic = sign * (prices - strike)
+            if i == 0:
+                exercised = intrinsic[:, 0] >= values[:, 0]
+            values = np.maximum(values, intrinsic)
+        if i <= 2:
+            nodes[i] = values, prices
+
+    return nodes, exercised
+
+
+def lattice_greeks(type, S, K, r, volatility, T, q, steps, method, american, greeks):
+    nodes, exercised = lattice_pass(type, S, K, r, volatility, T, q, steps, method, american)
+    (V0, S0), (V1, S1), (V2, S2) = nodes[0], nodes[1], nodes[2]
+
+    up = (V2[:, 2] - V2[:, 1]) / (S2[:, 2] - S2[:, 1])
+    down = (V2[:, 1] - V2[:, 0]) / (S2[:, 1] - S2[:, 0])
+    output = {'price': V0[:, 0],
+              'delta': (V1[:, 1] - V1[:, 0]) / (S1[:, 1] - S1[:, 0]),
+              'gamma': (up - down) / ((S2[:, 2] - S2[:, 0]) / 2)}
+
+    # The middle node two steps ahead is not at S on a Leisen-Reimer tree, so theta comes from the pricing
+    # equation with the tree's delta and gamma; it is zero where the option is exercised immediately.
+    theta = r * output['price'] - (r - q) * S * output['delta'] - volatility ** 2 * S ** 2 * output['gamma'] / 2
+    output['theta'] = np.where(exercised, 0, theta)
+
+    def price(**bump):
+        args = dict(S=S, K=K, r=r, volatility=volatility, T=T, q=q)
+        args.update({name: args[name] + value for name, value in bump.items()})
+        return lattice_pass(type, **args, steps=steps, method=method, american=american)[0][0][0][:, 0]
+
+    if 'vega' in greeks:
+        output['vega'] = (price(volatility=VEGA_BUMP) - price(volatility=-VEGA_BUMP)) / (2 * VEGA_BUMP)
+    if 'rho' in greeks:
+        output['rho'] = (price(r=RHO_BUMP) - price(r=-RHO_BUMP)) / (2 * RHO_BUMP)
+    return output
+
+
+def binomial_lattice(type, S, K, r, volatility, T, greeks=GREEKS, q=0, steps=LATTICE_STEPS, method='leisen_reimer',
+                     american=True, richardson=False, memory_budget=LATTICE_MEMORY_BUDGET):
+    # Same signature and broadcasting as black_scholes_merton, for options with early exercise.
+    # Only the first-order greeks are available: price, delta, gamma and theta come from the tree itself,
+    # vega and rho from repricing it, when they are asked for. Leisen-Reimer needs an odd number of steps.
+    # Richardson extrapolation combines `steps` with about half as many: the error is O(1/n²) with
+    # Leisen-Reimer, O(1/n) with CRR. The CRR error oscillates between odd and even numbers of steps,
+    # so it combines 2n and n steps with n even, both on the same side. Away from the money the CRR error
+    # also depends on where the strike falls between the nodes, which the extrapolation cannot remove.
+    if method not in LATTICE_METHODS:
+        raise ValueError(f'Unknown lattice method "{method}", expected one of {LATTICE_METHODS}')
+    if method == 'leisen_reimer':
+        steps += 1 - steps % 2
+        coarse_steps = steps // 2 + (steps // 2 + 1) % 2
+    else:
+        coarse_steps = steps // 2 + (steps // 2) % 2
+        if richardson:
+            steps = 2 * coarse_steps
+
+    arrays = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [S, K, r, volatility, T, q]])
+    shape = arrays[0].shape
+    arrays = [x.ravel() for x in arrays]
+    size = arrays[0].size
+
+    # Points are priced in chunks so that the few (points x nodes) arrays stay within the budget
+    chunk = max(1, memory_budget // (8 * 8 * (steps + 1)))
+    output = {}
+    for start in range(0, size, chunk):
+        batch = [x[start:start + chunk] for x in arrays]
+        values = lattice_greeks(type, *batch, steps, method, american, greeks)
+        if richardson:
+            coarse = lattice_greeks(type, *batch, coarse_steps, method, american, greeks)
+            order = 2 if method == 'leisen_reimer' else 1
+            fine, rough = steps ** order, coarse_steps ** order
+            values = {greek: (fine * values[greek] - rough * coarse[greek]) / (fine - rough) for greek in values}
+
+        for greek, value in values.items():
+            output.setdefault(greek, np.empty(size))[start:start + chunk] = value
+
+    return {greek: value.reshape(shape) for greek, value in output.items()}
@@ -45,12 +45,16 @@ LAYOUT = Div(
                     style={'textAlign': 'center', 'height': px(MAIN_HEIGHT - 20), 'width': '27.5%', 'border': '10px solid #F2DFAA'}
                 ),
                 Div(
-                    children=dcc.Loading(
+                    children=[dcc.Loading(
                         id="loading_output",
                         children=[example_button],
                         type="circle",
                         style={'position': 'absolute', 'top': '260px'}
                     ),
+                        Div(id='preview',
+                            style={'position': 'absolute', 'top': '0px', 'width': '100%', 'zIndex': 1,
+                                   'backgroundColor': 'white'}),
+                        dcc.Store(id='result_key')],
                     id='output',
                     style={'height': px(MAIN_HEIGHT - 20), 'width': '69.75%', 'position': 'absolute', 'top': '0px', 'left': '29%',
                            'border': '10px solid #ADD8E6', "overflow": "hidden"}
@@ -69,12 +73,18 @@ LAYOUT = Div(
                     Ol(children=[
                         Li("All of the empty spaces on the left must be filled for the model to work."),
                         Li("The toggle buttons allow to select the variables of interest. "
-                           "Choose one for 2D graphs or two for 3D graphs. "
+                           "Choose one for 2D graphs, two for 3D graphs or three for 3D graphs animated over the last one. "
                            "If selected, specify the Min and Max values across which to calculate the greek value.",
                            style={'margin-top': '8px'}),
                         Li("When you click the submit button, the output will appear on the right. "
                            "You can simply switch between graph and matrix by clicking the tab at the top.",
                            style={'margin-top': '8px'}),
+                        Li("Choose Portfolio as the option type to plot the aggregate greek of a book of positions, "
+                           "written as type,K,T,quantity in the box below the Submit button.",
+                           style={'margin-top': '8px'}),
+                        Li("Choose Scenario P&L as the result to revalue the option or portfolio over spot (%), "
+                           "volatility, rate and time (days) shocks around a single point, e.g. spot=-30:30; vol=-0.1:0.1.",
+                           style={'margin-top': '8px'}),
                     ],
                         style={'margin-top': '10px'},
                     )
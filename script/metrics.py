@@ -0,0 +1,128 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from store import cache, counter, results, outputs
+
+# Background callbacks run in their own processes, so every metric lives in the shared cache:
+# counters are atomic increments, histogram sums are kept in microseconds to stay integers.
+
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+STAGES = ['extract_value', 'sensitivity', 'build_figure', 'build_table', 'serialization']
+CALLBACKS = ['graph', 'switch_greek', 'matrix', 'load_frames', 'zoom']
+SLOW_REQUEST_SECONDS = 2
+
+logger = logging.getLogger(__name__)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help, label=None, values=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = values or [None]
+
+    def key(self, value):
+        return f'metrics-{self.name}-{value}'
+
+    def inc(self, amount=1, value=None):
+        cache.incr(self.key(value), amount, default=0)
+
+    def labels(self, value):
+        return [(self.label, value)] if self.label else []
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for value in self.values:
+            count = counter(self.key(value))
+            lines.append(f'{self.name}{format_labels(self.labels(value))} {count}')
+        return lines
+
+
+class Histogram(Counter):
+
+    def __init__(self, name, help, label=None, values=None, buckets=BUCKETS):
+        super().__init__(name, help, label, values)
+        self.buckets = buckets
+
+    def observe(self, seconds, value=None):
+        bucket = next((le for le in self.buckets if seconds <= le), '+Inf')
+        cache.incr(f'{self.key(value)}-bucket-{bucket}', default=0)
+        cache.incr(f'{self.key(value)}-count', default=0)
+        cache.incr(f'{self.key(value)}-sum', int(seconds * 1e6), default=0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for value in self.values:
+            labels = self.labels(value)
+
+            cumulative = 0
+            for le in self.buckets + ['+Inf']:
+                cumulative += counter(f'{self.key(value)}-bucket-{le}')
+                lines.append(f'{self.name}_bucket{format_labels(labels + [("le", le)])} {cumulative}')
+
+            total = counter(f'{self.key(value)}-sum') / 1e6
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {counter(f"{self.key(value)}-count")}')
+        return lines
+
+
+stage_seconds = Histogram('optiongreeks_stage_seconds', 'Time spent in each stage of website_output.',
+                          label='stage', values=STAGES)
+callback_seconds = Histogram('optiongreeks_callback_seconds', 'Total time of the Dash callbacks.',
+                             label='callback', values=CALLBACKS)
+callback_failures = Counter('optiongreeks_callback_failures_total',
+                            'Exceptions swallowed by a PreventUpdate in the Dash callbacks.',
+                            label='callback', values=CALLBACKS)
+grid_points = Counter('optiongreeks_grid_points_total', 'Grid points evaluated by the pricing kernel.')
+
+METRICS = [stage_seconds, callback_seconds, callback_failures, grid_points]
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
+
+
+@contextmanager
+def monitored(callback, **params):
+    # Times a whole callback, counts its failures and logs it with its parameters when it is slow
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        callback_failures.inc(value=callback)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        callback_seconds.observe(seconds, callback)
+        if seconds > SLOW_REQUEST_SECONDS:
+            logger.warning('Slow %s callback: %.3fs with %s', callback, seconds, params)
+
+
+def render_cache_stats():
+    name = 'optiongreeks_cache_requests_total'
+    lines = [f'# HELP {name} Lookups in the result caches, by cache and outcome.', f'# TYPE {name} counter']
+    for result_cache in [results, outputs]:
+        for outcome, count in result_cache.stats().items():
+            lines.append(f'{name}{format_labels([("cache", result_cache.name), ("outcome", outcome)])} {count}')
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += render_cache_stats()
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,83 @@
+from black_scholes_functions import GREEKS, black_scholes_merton
+from lattice import binomial_lattice
+from montecarlo import monte_carlo
+
+# Every model prices with the signature of black_scholes_merton, on top of a `base` kernel
+# (black_scholes_merton or atlas.atlas_black_scholes_merton) that takes the yield q of the underlying.
+
+
+def black_scholes_merton_dividend(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # A stock paying a continuous dividend yield q
+    return base(type, S, K, r, volatility, T, greeks, q=q)
+
+
+def black_76(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # Options on a future priced S: the future costs nothing to carry, so its yield is r.
+    # rho also moves the discounting of the future, which gives -T * price.
+    output = base(type, S, K, r, volatility, T, greeks, q=r)
+    output['rho'] = -T * output['price']
+    return output
+
+
+def garman_kohlhagen(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # FX options: S is the exchange rate, r the domestic rate and q the foreign rate
+    return base(type, S, K, r, volatility, T, greeks, q=q)
+
+
+def american_leisen_reimer(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # Early exercise on a Leisen-Reimer lattice: the base kernel does not apply
+    return binomial_lattice(type, S, K, r, volatility, T, greeks, q=q, method='leisen_reimer')
+
+
+def american_crr(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    return binomial_lattice(type, S, K, r, volatility, T, greeks, q=q, method='crr')
+
+
+def monte_carlo_asian(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # Options on the arithmetic average of the monitored prices, by simulation
+    return monte_carlo(type, S, K, r, volatility, T, greeks, q=q, payoff='asian')
+
+
+def monte_carlo_barrier(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # Knock-out options, with the barrier of montecarlo.BARRIER_LEVELS
+    return monte_carlo(type, S, K, r, volatility, T, greeks, q=q, payoff='barrier')
+
+
+def monte_carlo_lookback(type, S, K, r, volatility, T, greeks=GREEKS, q=0, base=black_scholes_merton):
+    # Floating-strike lookback options: K plays no part
+    return monte_carlo(type, S, K, r, volatility, T, greeks, q=q, payoff='lookback')
+
+
+# Model name -> label, kernel and label of its yield (None when the model has no yield)
+MODELS = {'bsm': ('Black-Scholes-Merton', black_scholes_merton_dividend, 'Dividend yield (q)'),
+          'black76': ('Black-76 (futures)', black_76, None),
+          'garman_kohlhagen': ('Garman-Kohlhagen (FX)', garman_kohlhagen, 'Foreign rate (rf)'),
+          'american_lr': ('American (Leisen-Reimer)', american_leisen_reimer, 'Dividend yield (q)'),
+          'american_crr': ('American (CRR)', american_crr, 'Dividend yield (q)'),
+          'mc_asian': ('Asian (Monte Carlo)', monte_carlo_asian, 'Dividend yield (q)'),
+          'mc_barrier': ('Barrier (Monte Carlo)', monte_carlo_barrier, 'Dividend yield (q)'),
+          'mc_lookback': ('Lookback (Monte Carlo)', monte_carlo_lookback, 'Dividend yield (q)')}
+
+# The models priced in closed form: cheap enough to evaluate whole tiles of the lattice of tiles.py,
+# points outside the requested range included. The lattice and Monte Carlo models only price what is asked.
+CLOSED_FORM = ['bsm', 'black76', 'garman_kohlhagen']
+
+
+class Model:
+    # A model of MODELS with its yield: called like black_scholes_merton, so it can be given as the `kernel`
+    # of evaluate, sensitivity_2D/3D and Portfolio.greeks. Its repr identifies it in the cache keys.
+
+    def __init__(self, name='bsm', q=0.0, base=black_scholes_merton):
+        if name not in MODELS:
+            raise ValueError(f'Unknown model "{name}", expected one of {list(MODELS)}')
+        self.name = name
+        self.q = float(q or 0) if MODELS[name][2] else 0.0
+        self.base = base
+
+    def __call__(self, type, S, K, r, volatility, T, greeks=GREEKS):
+        kernel = MODELS[self.name][1]
+        return kernel(type, S, K, r, volatility, T, greeks, q=self.q, base=self.base)
+
+    def __repr__(self):
+        return f'Model({self.name!r}, q={self.q!r}, base={self.base.__name__})'
+
@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from black_scholes_functions import GREEKS, black_scholes_merton
+
+MC_PATHS = 10_000
+MC_STEPS = 50
+MC_SEED = 0
+MC_MEMORY_BUDGET = 2 ** 27
+MC_WORKERS = os.cpu_count() or 1
+PAYOFFS = ['european', 'asian', 'barrier', 'lookback']
+MC_METHODS = ['pathwise', 'likelihood_ratio']
+MC_GREEKS = ['price', 'delta', 'theta', 'gamma', 'vega', 'rho']
+# Knock-out barriers as a multiple of the strike: up-and-out calls, down-and-out puts
+BARRIER_LEVELS = {'call': 1.25, 'put': 0.8}
+
+# Every path is simulated in units of the spot, R_k = S_k / S, so the payoff of a point is S * g(R, K / S):
+# the points sharing (r, σ, T, q) share their paths, and all the points share the normal draws.
+
+
+def path_statistics(Z, W, sum_Z, sum_Z2, r, volatility, T, q, extremes=True):
+    # The few per-path numbers the payoffs and their derivatives need, for a batch of (r, σ, T, q): each of shape
+    # (batch, paths). Only sums and the extremes of the paths are kept, so that a step costs a few passes.
+    steps = Z.shape[1]
+    r, volatility, T, q = [x[:, np.newaxis] for x in [r, volatility, T, q]]
+    dt = T / steps
+    k = np.arange(1, steps + 1)
+    drift = r - q - volatility ** 2 / 2
+    scale = volatility * np.sqrt(dt)
+
+    # log R_k = drift t_k + σ √dt W_k, with t_k = k dt. The (batch, paths, steps) arrays are float32, twice as
+    # fast as float64: their rounding, ~1e-7 of R, stays far below the standard error of any number of paths.
+    X = np.multiply(scale[:, :, np.newaxis], W.astype(np.float32), dtype=np.float32)
+    X += (drift * dt)[:, :, np.newaxis] * k
+    stats = {}
+    if extremes:
+        # The extremes are taken on the monitoring dates, so that only the paths depend on S.
+        # The derivatives of R_k are those of exp(drift t + σ √dt W) at the step k of the extreme.
+        for name, arg in [('min', X.argmin(axis=2)), ('max', X.argmax(axis=2))]:
+            R = np.exp(np.take_along_axis(X, arg[:, :, np.newaxis], axis=2)[:, :, 0].astype(np.float64))
+            t = dt * (arg + 1)
+            W_ = W[np.arange(len(W)), arg]
+            stats[name] = R
+            stats[f'{name}_vega'] = R * (np.sqrt(dt) * W_ - volatility * t)
+            stats[f'{name}_rho'] = R * t
+            stats[f'{name}_maturity'] = R * (drift * t + scale * W_ / 2) / T
+
+    R = np.exp(X, out=X)
+    # Means of R, R t and R W over the steps, from which those of its derivatives follow
+    mean, mean_k = np.moveaxis(R @ np.stack([np.ones(steps), k], axis=1).astype(np.float32), 2, 0) / steps
+    mean_t = dt * mean_k
+    mean_W = np.einsum('bps,ps->bp', R, W.astype(np.float32)) / steps
+    last = np.exp(drift * T + scale * sum_Z)
+    stats.update({'last': last, 'last_vega': last * (np.sqrt(dt) * sum_Z - volatility * T), 'last_rho': last * T,
+                  'last_maturity': last * (drift * T + scale * sum_Z / 2) / T,
+                  'mean': mean, 'mean_vega': np.sqrt(dt) * mean_W - volatility * mean_t, 'mean_rho': mean_t,
+                  'mean_maturity': (drift * mean_t + scale * mean_W / 2) / T,
+                  'z1': Z[:, 0] / scale,
+                  'z1_gamma': (Z[:, 0] ** 2 - 1 - Z[:, 0] * scale) / scale ** 2,
+                  'score_vega': (sum_Z2 - steps) / volatility - np.sqrt(dt) * sum_Z,
+                  'score_rho': np.sqrt(dt) * sum_Z / volatility,
+                  'score_maturity': ((sum_Z2 - steps) / 2 + drift * np.sqrt(dt) * sum_Z / volatility) / T})
+    return stats
+
+
+def payoff_integrands(type, payoff, stats, x):
+    # g, with its pathwise derivatives along the path: delta (in units of S), vega, rho and T (in units of 1/S)
+    sign = 1 if type == 'call' else -1
+    if payoff == 'lookback':
+        # Floating strike: S_T - min S_k for a call, max S_k - S_T for a put
+        extreme = 'min' if type == 'call' else 'max'
+        g = sign * (stats['last'] - stats[extreme])
+        return (g, g, sign * (stats['last_vega'] - stats[f'{extreme}_vega']),
+                sign * (stats['last_rho'] - stats[f'{extreme}_rho']),
+                sign * (stats['last_maturity'] - stats[f'{extreme}_maturity']))
+
+    under = 'mean' if payoff == 'asian' else 'last'
+    itm = sign * (stats[under] - x) > 0
+    g = np.where(itm, sign * (stats[under] - x), 0)
+    if payoff == 'barrier':
+        level = BARRIER_LEVELS[type] * x
+        g = g * ((stats['max'] < level) if type == 'call' else (stats['min'] > level))
+    return (g, sign * itm * stats[under], sign * itm * stats[f'{under}_vega'], sign * itm * stats[f'{under}_rho'],
+            sign * itm * stats[f'{under}_maturity'])
+
+
+def greek_samples(type, payoff, method, stats, S, x, r, T):
+    # One sample per path and point of each MC_GREEKS estimator, in money units.
+    # theta is minus the derivative in T, like the theta of black_scholes_merton.
+    discount = np.exp(-r * T)
+    g, delta, vega, rho, maturity = payoff_integrands(type, payoff, stats, x)
+    price = discount * S * g
+    if method == 'pathwise':
+        return [price,
+                discount * delta,
+                r * price - discount * S * maturity,
+                discount * delta * (stats['z1'] - 1) / S,
+                discount * S * vega,
+                discount * S * rho - T * price]
+    return [price,
+            discount * g * stats['z1'],
+            r * price - price * stats['score_maturity'],
+            discount * g * stats['z1_gamma'] / S,
+            price * stats['score_vega'],
+            price * stats['score_rho'] - T * price]
+
+
+def simulate_chunk(task):
+    # Sums over the paths of one chunk, for every point: (points, MC_GREEKS, [ΣG, ΣY, ΣG², ΣY², ΣGY]),
+    # where Y is the same estimator on the European payoff, used as a control variate.
+    (type, payoff, method, arrays, groups, steps, paths, seed, chunk, antithetic, memory_budget) = task
+    S, K, r, volatility, T, q = arrays
+
+    # One stream per chunk, whichever worker runs it: for a given seed, the result only depends on the number
+    # of chunks, that is on `workers` below the budget
+    rng = np.random.default_rng([seed, chunk])
+    Z = rng.standard_normal((paths // 2 if antithetic else paths, steps))
+    if antithetic:
+        Z = np.concatenate([Z, -Z])
+    W = np.cumsum(Z, axis=1)
+    sum_Z = W[:, -1]
+    sum_Z2 = (Z ** 2).sum(axis=1)
+
+    sums = np.zeros((len(S), len(MC_GREEKS), 5))
+    points = max(1, memory_budget // (8 * 16 * len(Z)))
+    # The statistics of several groups are computed at once, within the budget: a sweep of r, σ or T
+    # has as many groups as points
+    batch = max(1, memory_budget // (8 * 2 * Z.size))
+    for first in range(0, len(groups), batch):
+        market = np.array([row for row, index in groups[first:first + batch]])
+        batch_stats = path_statistics(Z, W, sum_Z, sum_Z2, *market.T, extremes=payoff in ['barrier', 'lookback'])
+        for j, ((r_, volatility_, T_, q_), index) in enumerate(groups[first:first + batch]):
+            stats = {name: values[j] for name, values in batch_stats.items()}
+            simulate_group(type, payoff, method, S, K, r_, T_, stats, index, points, antithetic, sums)
+    return sums
+
+
+def simulate_group(type, payoff, method, S, K, r, T, stats, index, points, antithetic, sums):
+    # Adds the sums of the points of one group to `sums`, by batches of `points`
+    paths = len(stats['last'])
+    for start in range(0, len(index), points):
+        idx = index[start:start + points]
+        S_, x = S[idx][:, np.newaxis], (K[idx] / S[idx])[:, np.newaxis]
+        samples = greek_samples(type, payoff, method, stats, S_, x, r, T)
+        controls = greek_samples(type, 'european', method, stats, S_, x, r, T)
+        for i, (G, Y) in enumerate(zip(samples, controls)):
+            G, Y = np.broadcast_to(G, (len(idx), paths)), np.broadcast_to(Y, (len(idx), paths))
+            if antithetic:
+                # A path and its mirror are one sample
+                G = (G[:, :paths // 2] + G[:, paths // 2:]) / 2
+                Y = (Y[:, :paths // 2] + Y[:, paths // 2:]) / 2
+            sums[idx, i] += np.stack([G.sum(axis=1), Y.sum(axis=1), (G * G).sum(axis=1),
+                                      (Y * Y).sum(axis=1), (G * Y).sum(axis=1)], axis=1)
+
+
+def monte_carlo(type, S, K, r, volatility, T, greeks=GREEKS, q=0, payoff='asian', method='pathwise',
+                paths=MC_PATHS, steps=MC_STEPS, seed=MC_SEED, antithetic=True, control=True, workers=MC_WORKERS,
+                memory_budget=MC_MEMORY_BUDGET):
+    # Same signature and broadcasting as black_scholes_merton, for path-dependent payoffs monitored on `steps`
+    # dates. Returns price, delta, theta, gamma, vega and rho, by the pathwise method (gamma mixes it with the
+    # likelihood ratio of the first step) or the likelihood-ratio method, which barriers always use, plus the
+    # standard error of the price. The control variate is the European option, with its closed-form greeks.
+    if payoff not in PAYOFFS:
+        raise ValueError(f'Unknown payoff "{payoff}", expected one of {PAYOFFS}')
+    if method not in MC_METHODS:
+        raise ValueError(f'Unknown method "{method}", expected one of {MC_METHODS}')
+    if payoff == 'barrier':
+        method = 'likelihood_ratio'
+
+    arrays = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [S, K, r, volatility, T, q]])
+    shape = arrays[0].shape
+    arrays = [x.ravel() for x in arrays]
+
+    market = np.stack(arrays[2:], axis=1)
+    rows, inverse = np.unique(market, axis=0, return_inverse=True)
+    groups = [(tuple(row), np.flatnonzero(inverse.ravel() == i)) for i, row in enumerate(rows)]
+
+    # Paths are drawn in chunks that fit the budget, so that 10^7 paths never exist at once,
+    # and in at least one chunk per worker. Chunks hold an even number of paths, for the antithetic pairs.
+    per_worker = -(-paths // max(1, workers))
+    chunk_paths = max(2, min(per_worker + per_worker % 2, memory_budget // (8 * 8 * steps) // 2 * 2))
+    chunks = [min(chunk_paths, paths - start) for start in range(0, paths, chunk_paths)]
+    tasks = [(type, payoff, method, arrays, groups, steps, n, seed, i, antithetic, memory_budget)
+             for i, n in enumerate(chunks)]
+
+    workers = min(workers, len(tasks))
+    if workers > 1 and not multiprocessing.current_process().daemon:
+        with ProcessPoolExecutor(workers) as pool:
+            sums = sum(pool.map(simulate_chunk, tasks))
+    else:
+        sums = sum(map(simulate_chunk, tasks))
+
+    n = sum(n // 2 if antithetic else n for n in chunks)
+    mean_G, mean_Y, mean_GG, mean_YY, mean_GY = np.moveaxis(sums / n, -1, 0)
+    var_G = mean_GG - mean_G ** 2
+    var_Y = mean_YY - mean_Y ** 2
+    cov = mean_GY - mean_G * mean_Y
+
+    if control:
+        exact = black_scholes_merton(type, *arrays[:5], q=arrays[5])
+        expected = np.stack([np.broadcast_to(exact[greek], arrays[0].shape) for greek in MC_GREEKS], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            beta = np.where(var_Y > 0, cov / var_Y, 0)
+        estimate = mean_G - beta * (mean_Y - expected)
+        variance = var_G - beta * cov
+    else:
+        estimate = mean_G
+        variance = var_G
+
+    output = {greek: estimate[:, i].reshape(shape) for i, greek in enumerate(MC_GREEKS)}
+    output['stderr'] = np.sqrt(np.maximum(variance[:, 0], 0) / n).reshape(shape)
+    return output
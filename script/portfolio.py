@@ -0,0 +1,79 @@
+import re
+
+import numpy as np
+
+from black_scholes_functions import GREEKS, black_scholes_merton
+from constants import MIN_MATURITY
+
+PORTFOLIO_MEMORY_BUDGET = 2 ** 28
+# Rough number of float64 temporaries the kernel allocates per evaluated point
+BYTES_PER_POINT = 8 * 16
+
+
+class Portfolio:
+    # A book of legs (type, K, T, quantity). A leg without K or T follows the value, or the sweep,
+    # of that variable in the panel; the others keep their own strike and maturity.
+
+    def __init__(self, types, K, T, quantity):
+        self.types = np.asarray(types, dtype=str)
+        self.K = np.asarray(K, dtype=float)
+        self.T = np.asarray(T, dtype=float)
+        self.quantity = np.asarray(quantity, dtype=float)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __repr__(self):
+        legs = ';'.join(f'{type},{K!r},{T!r},{quantity!r}'
+                        for type, K, T, quantity in zip(self.types, self.K.tolist(), self.T.tolist(),
+                                                        self.quantity.tolist()))
+        return f'Portfolio({legs})'
+
+    def greeks(self, S, K, r, volatility, T, time_forward=0, greeks=GREEKS, memory_budget=PORTFOLIO_MEMORY_BUDGET,
+               kernel=black_scholes_merton):
+        shape = np.broadcast_shapes(*[np.shape(x) for x in [S, K, r, volatility, T, time_forward]])
+        size = int(np.prod(shape))
+        output = {}
+
+        # Legs x grid points are evaluated in one broadcast, in as many chunks of legs as the budget requires
+        chunk = max(1, memory_budget // (BYTES_PER_POINT * size))
+        legs_axis = (slice(None),) + (np.newaxis,) * len(shape)
+
+        for type in ['call', 'put']:
+            legs = np.flatnonzero(self.types == type)
+            for start in range(0, len(legs), chunk):
+                idx = legs[start:start + chunk]
+                leg_K = self.K[idx][legs_axis]
+                leg_T = self.T[idx][legs_axis]
+                leg_K = np.where(np.isnan(leg_K), K, leg_K)
+                leg_T = np.where(np.isnan(leg_T), T, np.maximum(leg_T - time_forward, MIN_MATURITY))
+
+                values = kernel(type, S, leg_K, r, volatility, leg_T, greeks)
+                # Some kernels (e.g. the lattice) only give part of the greeks asked for
+                for greek in [greek for greek in greeks if greek in values]:
+                    value = np.broadcast_to(values[greek], (len(idx),) + shape)
+                    output.setdefault(greek, np.zeros(shape))
+                    output[greek] += np.tensordot(self.quantity[idx], value, axes=1)
+
+        return output
+
+
+def parse_positions(text):
+    # One leg per line (or separated by ';'): type,K,T,quantity, with K and T left empty to follow the panel
+    types, K, T, quantity = [], [], [], []
+    for line in re.split(r'[;\n]', text or ''):
+        if not line.strip():
+            continue
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) != 4 or fields[0].lower() not in ['call', 'put']:
+            raise ValueError(f'Invalid position "{line.strip()}", expected type,K,T,quantity')
+
+        types.append(fields[0].lower())
+        K.append(float(fields[1]) if fields[1] else np.nan)
+        T.append(float(fields[2]) if fields[2] else np.nan)
+        quantity.append(float(fields[3]))
+
+    if not types:
+        raise ValueError('The portfolio has no positions')
+
+    return Portfolio(types, K, T, quantity)
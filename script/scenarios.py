@@ -0,0 +1,92 @@
+import re
+
+import numpy as np
+
+from black_scholes_functions import ALL_GREEKS, GREEKS, Grid, black_scholes_merton, evaluate
+from constants import MIN_VOLATILITY, MIN_MATURITY
+from portfolio import BYTES_PER_POINT
+
+SCENARIO_MEMORY_BUDGET = 2 ** 28
+
+DEFAULT_SCENARIOS = 'spot=-30:30; vol=-0.1:0.1; rate=0; days=0'
+
+# Shock name -> axis label, and the factor from the written value to the shock used in scenario_analysis
+SHOCKS = {'spot': ('Spot move (%)', 1 / 100),
+          'vol': ('Volatility shift (σ)', 1),
+          'rate': ('Rate shift (r)', 1),
+          'days': ('Time forward (days)', 1 / 365)}
+
+
+def scenario_analysis(type, S, K, r, volatility, T, spot_shocks=(0.0,), vol_shocks=(0.0,), rate_shifts=(0.0,),
+                      time_forward=(0.0,), greeks=GREEKS, memory_budget=SCENARIO_MEMORY_BUDGET,
+                      kernel=black_scholes_merton):
+    # Full revaluation of an option (or Portfolio) over relative spot moves x absolute vol moves
+    # x rate shifts x time forward (in years). Returns the P&L against today's price and every greek the kernel
+    # gives, each with shape (spot, vol, rate, time).
+    spot, vol, rate, dt = np.meshgrid(*[np.asarray(x, dtype=float) for x in
+                                        [spot_shocks, vol_shocks, rate_shifts, time_forward]], indexing='ij')
+    shape = spot.shape
+    spot, vol, rate, dt = spot.ravel(), vol.ravel(), rate.ravel(), dt.ravel()
+
+    base = evaluate(type, S, K, r, volatility, T, kernel=kernel)['price']
+
+    # Scenarios are revalued in batches so that scenarios x legs stays within the memory budget
+    legs = 1 if isinstance(type, str) else len(type)
+    chunk = max(1, memory_budget // (BYTES_PER_POINT * legs))
+
+    output = {'pnl': np.empty(spot.size)}
+    for start in range(0, spot.size, chunk):
+        batch = slice(start, start + chunk)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = evaluate(type, S * (1 + spot[batch]), K, r + rate[batch],
+                              np.maximum(volatility + vol[batch], MIN_VOLATILITY),
+                              np.maximum(T - dt[batch], MIN_MATURITY), time_forward=dt[batch], kernel=kernel,
+                              greeks=greeks)
+        for greek in greeks:
+            if greek in values:
+                output.setdefault(greek, np.empty(spot.size))[batch] = values[greek]
+        output['pnl'][batch] = values['price'] - base
+
+    return {name: values.reshape(shape) for name, values in output.items()}
+
+
+def parse_scenarios(text, n):
+    # "spot=-30:30; vol=-0.1:0.1; rate=0; days=0": a range is sampled over n points, a number is a single shock
+    shocks = {name: np.zeros(1) for name in SHOCKS}
+    swept = []
+    for item in re.split(r'[;\n,]', text or DEFAULT_SCENARIOS):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip().lower()
+        if name not in SHOCKS:
+            raise ValueError(f'Unknown shock "{name}", expected one of {list(SHOCKS)}')
+
+        bounds = [float(x) for x in value.split(':')]
+        if len(bounds) == 2:
+            shocks[name] = np.linspace(bounds[0], bounds[1], n)
+            swept.append(name)
+        elif len(bounds) == 1:
+            shocks[name] = np.array(bounds)
+        else:
+            raise ValueError(f'Invalid shock "{item.strip()}", expected name=value or name=min:max')
+
+    swept = [name for name in SHOCKS if name in swept]
+    if not 1 <= len(swept) <= 2:
+        raise ValueError('Give a min:max range to one or two of the shocks')
+    return shocks, swept
+
+
+def scenario_grid(type, S, K, r, volatility, T, text, n, kernel=black_scholes_merton):
+    if any(isinstance(x, tuple) for x in [S, K, r, volatility, T]):
+        raise ValueError('Scenarios are computed around a single point: switch off the variable ranges')
+
+    shocks, swept = parse_scenarios(text, n)
+    values = scenario_analysis(type, S, K, r, volatility, T,
+                               *[shocks[name] * factor for name, (label, factor) in SHOCKS.items()],
+                               greeks=ALL_GREEKS, kernel=kernel)
+
+    # Drop the shocks held at a single value, so that the grid is a line or a surface
+    axes = tuple(i for i, name in enumerate(SHOCKS) if name not in swept)
+    values = {name: value.squeeze(axis=axes) for name, value in values.items()}
+    return Grid(values, [shocks[name] for name in swept], [SHOCKS[name][0] for name in swept])
@@ -0,0 +1,274 @@
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha1
+from numbers import Number
+from uuid import uuid4
+
+import psutil
+
+RESULT_EXPIRE = 60 * 60
+MEMORY_SIZE = 32
+# Bytes of values kept by the in-process tier of each ResultCache, in every worker
+MEMORY_BYTES = 2 ** 27
+CACHE_SIZE_LIMIT = 2 ** 29
+# A computation holds its lock for LOCK_LEASE seconds at a time, renewed while it runs: the lock of a killed job
+# frees itself within a lease, at once when its waiters run on the same host and see that its process is gone.
+LOCK_LEASE = 5
+LOCK_POLL = 0.05
+
+
+# Compare-and-act on a lock: only while it still holds the token of the caller
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCache:
+    # Minimal subset of the diskcache.Cache interface on top of a Redis client,
+    # so that the web workers and the Celery workers share the same results.
+
+    def __init__(self, client):
+        self.client = client
+        self.renew_script = client.register_script(RENEW_SCRIPT)
+        self.release_script = client.register_script(RELEASE_SCRIPT)
+
+    def get(self, key, default=None):
+        value = self.client.get(key)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, expire=None):
+        return self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=expire)
+
+    def delete(self, key):
+        return bool(self.client.delete(key))
+
+    def incr(self, key, delta=1, default=0):
+        return self.client.incrby(key, delta)
+
+    def counter(self, key):
+        # INCRBY keeps counters as plain integers, not pickles
+        value = self.client.get(key)
+        return 0 if value is None else int(value)
+
+    def add(self, key, value, expire=None):
+        return bool(self.client.set(key, pickle.dumps(value), nx=True, ex=expire))
+
+    def touch(self, key, expire=None):
+        return bool(self.client.expire(key, expire))
+
+    def renew(self, key, value, expire):
+        return bool(self.renew_script(keys=[key], args=[pickle.dumps(value), expire]))
+
+    def release(self, key, value):
+        return bool(self.release_script(keys=[key], args=[pickle.dumps(value)]))
+
+    def __contains__(self, key):
+        return bool(self.client.exists(key))
+
+
+if 'REDIS_URL' in os.environ:
+    import redis
+
+    cache = RedisCache(redis.from_url(os.environ['REDIS_URL']))
+
+else:
+    import diskcache
+
+    cache = diskcache.Cache("./cache", size_limit=CACHE_SIZE_LIMIT, eviction_policy='least-recently-used')
+
+
+def counter(key):
+    # The value of a key written by cache.incr
+    if isinstance(cache, RedisCache):
+        return cache.counter(key)
+    return cache.get(key, default=0)
+
+
+def owner_token():
+    # Unique to each acquisition of a lock. The host and pid tell the waiters whether its owner still runs.
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex}'
+
+
+def owner_gone(token):
+    # Only known for an owner on this host: elsewhere its lease has to run out
+    host, pid, _ = token.split(':')
+    if host != socket.gethostname():
+        return False
+    try:
+        # A killed job stays a zombie until its parent reaps it
+        return psutil.Process(int(pid)).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+def renew(lock, token, expire=LOCK_LEASE):
+    # Extends the lock only if `token` still holds it, never once it expired and another worker took it
+    if isinstance(cache, RedisCache):
+        return cache.renew(lock, token, expire)
+    with cache.transact():
+        return cache.get(lock) == token and cache.touch(lock, expire=expire)
+
+
+def release(lock, token):
+    # Deletes the lock only if `token` still holds it
+    if isinstance(cache, RedisCache):
+        return cache.release(lock, token)
+    with cache.transact():
+        return cache.get(lock) == token and cache.delete(lock)
+
+
+@contextmanager
+def lease(lock, token, expire=LOCK_LEASE):
+    # Keeps renewing a lock taken with cache.add(lock, token) until the block exits, then releases it
+    done = threading.Event()
+
+    def keep():
+        while not done.wait(expire / 3):
+            if not renew(lock, token, expire):
+                return
+
+    thread = threading.Thread(target=keep, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+        release(lock, token)
+
+
+def size_of(value):
+    # The size of the pickle of a value, without copying its arrays: they are counted by their buffers
+    buffers = []
+    data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    return len(data) + sum(buffer.raw().nbytes for buffer in buffers)
+
+
+def normalize(param):
+    # 50, 50.0 and 50.000000000001 must all hit the same entry
+    if isinstance(param, (tuple, list)):
+        return tuple(normalize(x) for x in param)
+    if isinstance(param, Number) and not isinstance(param, bool):
+        return float(f'{param:.12g}')
+    return param
+
+
+class ResultCache:
+    # Two tiers: a small LRU in the current process, in front of the shared cache
+    # that every gunicorn (and background) worker opens.
+
+    def __init__(self, name, maxsize=MEMORY_SIZE, expire=RESULT_EXPIRE, maxbytes=MEMORY_BYTES):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.expire = expire
+        self.memory = OrderedDict()
+        self.size = 0
+
+    def key(self, *params):
+        return f'{self.name}-' + sha1(repr(normalize(params)).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            value, expires, size = entry
+            if expires > time.time():
+                self.memory.move_to_end(key)
+                self.count('memory_hits')
+                return value
+            self.forget(key)
+
+        value = cache.get(key)
+        if value is not None:
+            self.remember(key, value)
+            self.count('shared_hits')
+            return value
+
+        self.count('misses')
+        return None
+
+    def set(self, key, value):
+        cache.set(key, value, expire=self.expire)
+        self.remember(key, value)
+
+    def __contains__(self, key):
+        # Without loading the value
+        return key in self.memory or key in cache
+
+    def get_or_compute(self, key, compute):
+        # Single flight: of the workers missing the same key, the first one to take its lock computes it
+        # and the others poll the shared cache until the result lands there, or the lock is freed
+        value = self.get(key)
+        lock = f'lock-{key}'
+        token = owner_token()
+        while value is None:
+            if cache.add(lock, token, expire=LOCK_LEASE):
+                with lease(lock, token):
+                    # The previous owner may have stored the result and released the lock since the last read
+                    value = self.coalesce(key)
+                    if value is None:
+                        value = compute()
+                        self.set(key, value)
+                return value
+
+            # An identical submit terminates the job that holds the lock: its successor takes over at once
+            owner = cache.get(lock)
+            if owner is not None and owner_gone(owner):
+                release(lock, owner)
+                continue
+
+            time.sleep(LOCK_POLL)
+            value = self.coalesce(key)
+        return value
+
+    def coalesce(self, key):
+        # The result of another worker's computation, from the shared cache
+        value = cache.get(key)
+        if value is not None:
+            self.remember(key, value)
+            self.count('coalesced')
+        return value
+
+    def remember(self, key, value):
+        # Least recently used first, within both maxsize entries and maxbytes: a value larger than maxbytes
+        # is only kept in the shared cache
+        size = size_of(value)
+        self.forget(key)
+        if size > self.maxbytes:
+            return
+        self.memory[key] = (value, time.time() + self.expire, size)
+        self.size += size
+        while len(self.memory) > self.maxsize or self.size > self.maxbytes:
+            self.forget(next(iter(self.memory)))
+
+    def forget(self, key):
+        entry = self.memory.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def count(self, name):
+        cache.incr(f'stats-{self.name}-{name}', default=0)
+
+    def stats(self):
+        return {name: counter(f'stats-{self.name}-{name}')
+                for name in ['memory_hits', 'shared_hits', 'misses', 'coalesced']}
+
+
+results = ResultCache('grid')
+outputs = ResultCache('output')
@@ -0,0 +1,115 @@
+from functools import partial
+from itertools import product
+
+import numpy as np
+
+from metrics import grid_points
+from parallel import evaluate_sharded
+from store import ResultCache
+
+# Points per side of a tile, by number of swept variables
+TILE_SIDE = {1: 256, 2: 64}
+TILE_MEMORY_SIZE = 128
+
+# A swept variable is sampled on a canonical lattice, the multiples m * h of a power of 2 h, rather than on
+# np.linspace(lo, hi, n): requests whose ranges overlap at the same h share the values of the shared points.
+# The lattice is cut in tiles of TILE_SIDE points per axis, cached under everything but the swept ranges,
+# so that widening a range or zooming into it only computes the tiles that were never seen. The exact bounds are
+# added at both ends of every axis when they are not lattice points, so the grid still spans the requested range.
+
+tiles = ResultCache('tile', maxsize=TILE_MEMORY_SIZE)
+
+
+def lattice_steps(lo, hi, n):
+    # The powers of 2 around (hi - lo) / (n - 1): n to 2n points in [lo, hi], or n/2 to n
+    base = np.log2((hi - lo) / (n - 1))
+    return sorted({2.0 ** np.floor(base), 2.0 ** np.ceil(base)})
+
+
+def lattice_span(lo, hi, step):
+    # First and last index of the lattice points inside [lo, hi], with some slack for the rounding
+    return int(np.ceil(lo / step - 1e-9)), int(np.floor(hi / step + 1e-9))
+
+
+def tile_keys(context, steps, spans, side):
+    ranges = [range(first // side, last // side + 1) for first, last in spans]
+    return {index: tiles.key(context, steps, index) for index in product(*ranges)}
+
+
+def choose_lattice(context, bounds, n, side):
+    # The steps with the most tiles cached already, then with the number of points closest to n
+    best = None
+    for steps in product(*[lattice_steps(lo, hi, n) for lo, hi in bounds]):
+        spans = [lattice_span(lo, hi, step) for (lo, hi), step in zip(bounds, steps)]
+        keys = tile_keys(context, steps, spans, side)
+        cached = sum(key in tiles for key in keys.values())
+        distance = sum(abs(np.log((last - first + 1) / n)) for first, last in spans)
+        if best is None or (cached, -distance) > best[0]:
+            best = (cached, -distance), steps, spans, keys
+    return best[1:]
+
+
+def tile_task(task, steps, indices, side, start, stop):
+    # The tiles indices[start:stop], stacked along a first axis
+    values = [task([step * np.arange(i * side, (i + 1) * side) for step, i in zip(steps, index)])
+              for index in indices[start:stop]]
+    return {greek: np.stack([value[greek] for value in values]) for greek in values[0]}
+
+
+def tiled_grid(task, context, bounds, n, workers=1):
+    # task(axes) evaluates the greeks on the product of `axes`, one array of lattice points per swept variable.
+    # Returns the greeks and the axes of the lattice points inside `bounds`, about n per axis, and of the bounds.
+    bounds = [(min(lo, hi), max(lo, hi)) for lo, hi in bounds]
+    if any(lo == hi for lo, hi in bounds):
+        # No lattice fits an empty range
+        axes = [np.linspace(lo, hi, n) for lo, hi in bounds]
+        grid_points.inc(n ** len(bounds))
+        return task(axes), axes
+
+    side = TILE_SIDE[len(bounds)]
+    steps, spans, keys = choose_lattice(context, bounds, n, side)
+
+    found = {index: tiles.get(key) for index, key in keys.items()}
+    missing = [index for index, values in found.items() if values is None]
+    if missing:
+        computed = evaluate_sharded(partial(tile_task, task, steps, missing, side), len(missing),
+                                    len(missing) * side ** len(bounds), workers)
+        # Whole tiles are evaluated, so the points counted here are more than those of the grid
+        grid_points.inc(len(missing) * side ** len(bounds))
+        for k, index in enumerate(missing):
+            found[index] = {greek: values[k] for greek, values in computed.items()}
+            tiles.set(keys[index], found[index])
+
+    # The bounds, unless a lattice point is on them already (up to the slack of lattice_span)
+    axes, inside, edges = [], [], []
+    for (lo, hi), step, (first, last) in zip(bounds, steps, spans):
+        before, after = bool(first * step - lo > 1e-9 * step), bool(hi - last * step > 1e-9 * step)
+        axis = step * np.arange(first, last + 1)
+        if not before:
+            axis[0] = lo
+        if not after:
+            axis[-1] = hi
+        axes.append(np.concatenate([[lo] * before, axis, [hi] * after]))
+        inside.append(slice(int(before), int(before) + len(axis)))
+        edges.append([0] * before + [len(axes[-1]) - 1] * after)
+
+    # Stitch the part of every tile that falls inside the grid
+    shape = tuple(len(axis) for axis in axes)
+    output = {}
+    for index, values in found.items():
+        grid, tile = [], []
+        for i, (first, last), offset in zip(index, spans, inside):
+            lo, hi = max(i * side, first), min((i + 1) * side, last + 1)
+            grid.append(slice(lo - first + offset.start, hi - first + offset.start))
+            tile.append(slice(lo - i * side, hi - i * side))
+        for greek, value in values.items():
+            output.setdefault(greek, np.empty(shape))[tuple(grid)] = value[tuple(tile)]
+
+    # Then the rows (or columns) of the bounds that were added
+    for k, indices in enumerate(edges):
+        if indices:
+            values = task([axis[indices] if d == k else axis for d, axis in enumerate(axes)])
+            grid_points.inc(len(indices) * int(np.prod(shape)) // shape[k])
+            for greek, value in values.items():
+                output[greek][tuple(indices if d == k else slice(None) for d in range(len(axes)))] = value
+    return output, axes
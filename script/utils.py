@@ -1,9 +1,8 @@
-from itertools import repeat
+from base64 import b64encode
 
 import numpy as np
-import pandas as pd
 
-from dash.html import Div
+from dash.html import A, Div, P
 from dash.dash_table import DataTable
 from dash import dcc
 
@@ -11,8 +10,16 @@ import plotly.graph_objects as go
 
 from items import tab_style, tabs_styles, tab_selected_style
 
+from adaptive import ADAPTIVE_BUDGET
+from atlas import atlas_black_scholes_merton
 from black_scholes_functions import *
 from constants import *
+from export import EXPORT_FORMATS
+from metrics import timed, grid_points
+from models import CLOSED_FORM, Model
+from parallel import PARALLEL_WORKERS
+from scenarios import DEFAULT_SCENARIOS, parse_scenarios, scenario_grid
+from store import results, outputs
 
 
 def px(x):
@@ -26,13 +33,60 @@ def extract_value(on, v, vm, vM):
         return v
 
 
+def round_significant(values, precision):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    magnitude = np.where(np.isfinite(magnitude), magnitude, 0)
+    with np.errstate(over='ignore', invalid='ignore'):
+        # Subnormal values would overflow the scale: they are kept as they are
+        scale = np.power(10, precision - 1 - magnitude, dtype=np.float64)
+        rounded = np.round(values * scale) / scale
+    return np.where(np.isfinite(scale), rounded, values).astype(values.dtype)
+
+
+def round_to_range(values, precision):
+    # To `precision` significant digits of the range of the array (max - min), not of each value:
+    # a step of the rounding stays far below what the plot can show, however small the values
+    finite = values[np.isfinite(values)]
+    span = finite.max() - finite.min() if finite.size else 0
+    if span == 0:
+        return values
+    return np.round(values, precision - 1 - int(np.floor(np.log10(span))))
+
+
+def encode_array(values, precision=FIGURE_PRECISION):
+    values = np.asarray(values, dtype=np.float64)
+    if TYPED_ARRAYS:
+        values = values if precision is None else round_to_range(values, precision)
+        return {'dtype': 'f4',
+                'bdata': b64encode(values.astype(np.float32).tobytes()).decode(),
+                'shape': ', '.join(map(str, values.shape))}
+
+    # Rounded in float64, the JSON encoder writes the shortest repr of each value, against the 17 digits of a
+    # float64: those the range needs with the cap, whatever the size of the values, or the ~7 of a float32
+    if precision is None:
+        return round_significant(values, FLOAT32_DIGITS).tolist()
+    return round_to_range(values, precision).tolist()
+
+
+def encode_figure(fig, x, y, z=None):
+    # Only the greeks (y of a line, z of a surface) are capped to FIGURE_PRECISION: the coordinates keep
+    # the digits of a float32
+    figure = fig.to_plotly_json()
+    if z is None:
+        figure['data'][0].update(x=encode_array(x, None), y=encode_array(y))
+    else:
+        figure['data'][0].update(x=encode_array(x, None), y=encode_array(y, None), z=encode_array(z))
+    return figure
+
+
 def build_figure(result, on):
-    if len(result) == 2:
+    if result.dim == 1:
 
-        data, x = result
-        X = data.index.values
-        Y = data.values.flatten()
-        fig = go.Figure(data=go.Scatter(x=X, y=Y, mode='lines'))
+        X = result.axes[0]
+        Y = result.values
+        x = result.labels[0]
+        fig = go.Figure(data=go.Scatter(mode='lines'))
         fig.update_layout(plot_bgcolor='white',
                           xaxis_title=x,
                           yaxis_title=on
@@ -52,11 +106,13 @@ def build_figure(result, on):
             gridcolor='lightgrey'
         )
 
-        return dcc.Graph(figure=fig, style={'position': 'relative', 'height': '96%', 'padding': '0% 2% 2%'})
+        figure = encode_figure(fig, x=X, y=Y)
+        return dcc.Graph(id='line', figure=figure,
+                         style={'position': 'relative', 'height': '96%', 'padding': '0% 2% 2%'})
 
-    elif len(result) == 3:
-        data, y, x = result
-        fig = go.Figure(data=go.Surface(z=data.values, x=data.columns.values, y=data.index.values))
+    elif result.dim == 2:
+        y, x = result.labels
+        fig = go.Figure(data=go.Surface())
         fig.update_layout(margin={'l': 0, 'r': 0, 'b': 0, 't': 0})
         fig.update_scenes(xaxis_title=x,
                           yaxis_title=y,
@@ -64,63 +120,128 @@ def build_figure(result, on):
                           )
         fig.update_traces(showscale=False)
 
-        return dcc.Graph(figure=fig, config={'scrollZoom': True}, style={'position': 'relative', 'height': '100%'})
-
-
-def datatable_settings_multiindex(df, flatten_char='_'):
-    datatable_col_list = []
-
-    levels = df.columns.nlevels
-    if levels == 1:
-        for i in df.columns:
-            datatable_col_list.append({"name": i, "id": i})
-    else:
-        columns_list = []
-        for i in df.columns:
-            col_id = flatten_char.join(i)
-            datatable_col_list.append({"name": i, "id": col_id})
-            columns_list.append(col_id)
-        df.columns = columns_list
-
-    datatable_data = df.to_dict('records')
-
-    return datatable_data, datatable_col_list
-
-
-def build_matrix(result, dim):
-    if dim == 1:
-
-        data, x = result
-        slices = [int((data.shape[0] - 1) * x) for x in np.linspace(0, 1, 11)]
-        data.index = np.round(data.index, 3).map(str)
-        data.index = pd.MultiIndex.from_tuples(list(zip(repeat(x), data.index)))
-
-        matrix = data.iloc[slices].T.round(3).copy()
-        matrix = matrix.rename(columns={'index': x})
-
-        matrix, columns = datatable_settings_multiindex(matrix)
+        figure = encode_figure(fig, z=result.values, x=result.axes[1], y=result.axes[0])
+        return dcc.Graph(figure=figure, config={'scrollZoom': True}, style={'position': 'relative', 'height': '100%'})
+
+    elif result.dim == 3:
+        # Only the first frame is sent: the store triggers load_frames, which sends the others once it is displayed
+        figure = animation_figure(result, on)
+        return [dcc.Graph(id='animation', figure=figure, config={'scrollZoom': True},
+                          style={'position': 'relative', 'height': '100%'}),
+                dcc.Store(id='animation_frames', data=len(result.axes[2]))]
+
+
+def zoom_figure(relayout, figure, key, on):
+    # A line zoomed into a range is recomputed there at full resolution, from the tiles of the lattice,
+    # and autoscale goes back to the cached grid. Returns None when there is nothing to redraw.
+    result = results.get(key).select(on)
+    if result.source is None:
+        return None
+    if relayout.get('xaxis.autorange'):
+        return build_figure(result, on).figure
+
+    bounds = relayout.get('xaxis.range') or [relayout.get('xaxis.range[0]'), relayout.get('xaxis.range[1]')]
+    if None in bounds or list(bounds) == figure['layout'].get('xaxis', {}).get('range'):
+        return None
+
+    # Only within the range of the request
+    type, variables, kernel = result.source
+    i = next(i for i, variable in enumerate(variables) if isinstance(variable, tuple))
+    bounds = [max(min(bounds), min(variables[i])), min(max(bounds), max(variables[i]))]
+    if bounds[0] >= bounds[1]:
+        return None
+
+    variables = list(variables)
+    variables[i] = tuple(bounds)
+    zoomed = sensitivity_2D(type, None, *variables, kernel=kernel, lattice=True)
+    figure = build_figure(zoomed.select(on), on).figure
+    figure['layout']['xaxis']['range'] = bounds
+    return figure
+
+
+def animation_figure(result, on, frames=False):
+    # A surface over the first two axes with a slider over the third. The frames only carry z,
+    # and the axes and colours are fixed to the range of the whole tensor so that they do not jump.
+    y, x, t = result.labels
+    with np.errstate(invalid='ignore'):
+        finite = result.values[np.isfinite(result.values)]
+    bounds = [float(finite.min()), float(finite.max())] if finite.size else None
+
+    steps = [{'label': label, 'method': 'animate',
+              'args': [[str(k)], {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': True},
+                                  'transition': {'duration': 0}}]}
+             for k, label in enumerate(format_axis(result.axes[2]))]
+    play = {'label': 'Play', 'method': 'animate',
+            'args': [None, {'frame': {'duration': 100, 'redraw': True}, 'fromcurrent': True,
+                            'transition': {'duration': 0}}]}
+    pause = {'label': 'Pause', 'method': 'animate',
+             'args': [[None], {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': False}}]}
+
+    fig = go.Figure(data=go.Surface())
+    fig.update_layout(margin={'l': 0, 'r': 0, 'b': 0, 't': 0},
+                      sliders=[{'steps': steps, 'currentvalue': {'prefix': f'{t}: '}, 'pad': {'t': 10}}],
+                      updatemenus=[{'type': 'buttons', 'buttons': [play, pause], 'direction': 'left',
+                                    'x': 0, 'y': 0, 'xanchor': 'right', 'yanchor': 'top'}])
+    fig.update_scenes(xaxis_title=x,
+                      yaxis_title=y,
+                      zaxis_title=on,
+                      zaxis_range=bounds
+                      )
+    fig.update_traces(showscale=False, cmin=bounds and bounds[0], cmax=bounds and bounds[1])
+
+    figure = encode_figure(fig, z=result.values[:, :, 0], x=result.axes[1], y=result.axes[0])
+    if frames:
+        figure['frames'] = [{'name': str(k), 'traces': [0], 'data': [{'z': encode_array(result.values[:, :, k])}]}
+                            for k in range(len(result.axes[2]))]
+    return figure
+
+
+def animation_frames(key, on):
+    return animation_figure(results.get(key).select(on), on, frames=True)
+
+
+def sample_indices(n, samples=11):
+    return (np.linspace(0, 1, samples) * (n - 1)).astype(int)
+
+
+def format_axis(values):
+    return [str(x) for x in np.round(values, 3).tolist()]
+
+
+def build_matrix(result):
+    # Only the 11 sampled rows/columns are rounded and formatted, straight from the ndarray
+    if result.dim == 1:
+        x = result.labels[0]
+        slices = sample_indices(len(result.axes[0]))
+
+        names = format_axis(result.axes[0][slices])
+        ids = [f'{x}_{name}' for name in names]
+        columns = [{"name": (x, name), "id": col_id} for name, col_id in zip(names, ids)]
+        matrix = [dict(zip(ids, np.round(result.values[slices], 3).tolist()))]
 
         return matrix, columns
 
-    elif dim == 2:
-        data, y, x = result
-        slices_x = [int((data.shape[0] - 1) * x) for x in np.linspace(0, 1, 11)]
-        slices_y = [int((data.shape[1] - 1) * y) for y in np.linspace(0, 1, 11)]
-
-        data.index = np.round(data.index, 3).map(str)
-        data.columns = np.round(data.columns, 3).map(str)
-        data.columns = pd.MultiIndex.from_tuples(list(zip(repeat(x), data.columns)))
+    elif result.dim == 2:
+        y, x = result.labels
+        slices_x = sample_indices(len(result.axes[0]))
+        slices_y = sample_indices(len(result.axes[1]))
 
-        matrix = data.iloc[slices_x, slices_y].round(3).reset_index().copy()
-        matrix = matrix.rename(columns={'': y, 'index': ''})
+        first_col_id = f'_{y}'
+        names = format_axis(result.axes[1][slices_y])
+        ids = [f'{x}_{name}' for name in names]
+        columns = [{"name": ('', y), "id": first_col_id}] + \
+                  [{"name": (x, name), "id": col_id} for name, col_id in zip(names, ids)]
 
-        matrix, columns = datatable_settings_multiindex(matrix)
+        values = np.round(result.values[np.ix_(slices_x, slices_y)], 3).tolist()
+        matrix = [{first_col_id: index, **dict(zip(ids, row))}
+                  for index, row in zip(format_axis(result.axes[0][slices_x]), values)]
 
         return matrix, columns
 
 
-def build_table(result, dim):
-    matrix, columns = build_matrix(result, dim)
+def build_table(result):
+    dim = result.dim
+    matrix, columns = build_matrix(result)
     first_col_id = next(iter(matrix[0]))
 
     if dim == 1:
@@ -160,7 +281,7 @@ def build_table(result, dim):
         return table
 
 
-def build_tabs(graph, table):
+def build_tabs(graph, table=None):
     global GRAPH_HEIGHT
 
     global tabs_style
@@ -175,6 +296,7 @@ def build_tabs(graph, table):
                 style={'height': GRAPH_HEIGHT}
             ),
             label='View Graph',
+            value='graph',
             id='tab_graph',
             style=tab_style,
             selected_style=tab_selected_style
@@ -188,6 +310,7 @@ def build_tabs(graph, table):
                            'margin-top': '8%', 'margin-bottom': '8%'}
                 ),
                 label='View Matrix',
+                value='matrix',
                 id='tab_matrix',
                 style=tab_style,
                 selected_style=tab_selected_style
@@ -195,6 +318,7 @@ def build_tabs(graph, table):
         ],
 
         id="tabs-graph-matrix",
+        value='graph',
         style=tabs_styles,
         content_style={'height': '100%'},
         parent_style={'height': '100%'}
@@ -202,18 +326,119 @@ def build_tabs(graph, table):
     return tabs
 
 
-def website_output(type, on, S, K, r, v, T):
-    dim = sum([1 for x in [S, K, r, v, T] if isinstance(x, tuple)])
+def build_message(text):
+    return P(text, style={'font-family': 'Arial', 'font-size': '15px', 'textAlign': 'center', 'margin-top': '20px'})
 
-    if dim == 1:
-        result = sensitivity_2D(type, on, S, K, r, v, T)
-        figure = build_figure(result, on)
-        table = build_table(result, dim)
-        tabs = build_tabs(figure, table)
-        return [tabs]
+
+def unavailable(on):
+    # The lattice and Monte Carlo models only give the first-order greeks
+    return build_message(f'The {on} is not available for this model: choose another greek or model.')
+
+
+def greek_figure(key, on):
+    result = results.get(key)
+    if on not in result.values:
+        return unavailable(on)
+    return build_figure(result.select(on), on)
+
+
+def greek_table(key, on):
+    result = results.get(key)
+    if on not in result.values:
+        return [unavailable(on), build_downloads(key)]
+    result = result.select(on)
+    if result.dim == 3:
+        # Animations have no table, only the downloads
+        return [build_downloads(key)]
+    with timed('build_table'):
+        return [build_table(result), build_downloads(key)]
+
+
+def build_downloads(key):
+    # The table only samples the grid: these links stream all of it, see api.export
+    links = [A(format.upper(), href=f'/api/export/{key}?format={format}', download=f'greeks.{format}',
+               style={'margin-left': '10px'})
+             for format in EXPORT_FORMATS]
+    return P(['Download the full grid:'] + links,
+             style={'font-family': 'Arial', 'font-size': '15px', 'textAlign': 'center', 'margin-top': '20px'})
+
+
+def build_preview(result, on, n, n3D):
+    figure = build_figure(result, on)
+    label = P(f'Refining the surface: {n} x {n} of {n3D} x {n3D}',
+              style={'font-family': 'Arial', 'font-size': '15px', 'textAlign': 'center', 'margin': '0px',
+                     'line-height': px(TABS_HEIGHT)})
+    return [label, Div(children=figure, style={'height': GRAPH_HEIGHT})]
+
+
+def website_output(type, on, S, K, r, v, T, n3D=N3D, set_progress=None, scenarios=None, model='bsm', q=0):
+    if on == 'pnl':
+        # The scenario P&L is a line or a surface over the shocks given a range, around a single point
+        scenarios = scenarios or DEFAULT_SCENARIOS
+        dim = len(parse_scenarios(scenarios, 1)[1])
     else:
-        result = sensitivity_3D(type, on, S, K, r, v, T)
-        figure = build_figure(result, on)
-        table = build_table(result, dim)
-        tabs = build_tabs(figure, table)
-        return [tabs]
+        dim = sum([1 for x in [S, K, r, v, T] if isinstance(x, tuple)])
+        scenarios = None
+    # Adaptive sampling applies to the lines and surfaces of the greeks, the others get the default resolution
+    adaptive = n3D == ADAPTIVE and scenarios is None and dim in [1, 2]
+    if n3D == ADAPTIVE:
+        n3D = N3D
+    n = N2D if dim == 1 else n3D
+    if dim == 3:
+        n = min(n, int(np.sqrt(ANIMATION_MAX_POINTS / ANIMATION_FRAMES)))
+    budget = ADAPTIVE_BUDGET[dim] if adaptive else None
+    kernel = Model(model, q, base=atlas_black_scholes_merton if USE_ATLAS else black_scholes_merton)
+    # The lattice counts the points of the tiles it evaluates itself, see tiles.tiled_grid
+    lattice = USE_LATTICE and model in CLOSED_FORM
+
+    key = results.key(type, S, K, r, v, T, n, scenarios, repr(kernel), budget)
+    output_key = outputs.key(type, on, S, K, r, v, T, n, scenarios, repr(kernel), budget)
+
+    tabs = outputs.get(output_key)
+    if tabs is not None:
+        return tabs, key
+
+    def compute():
+        if scenarios is not None:
+            with timed('sensitivity'):
+                result = scenario_grid(type, S, K, r, v, T, scenarios, n, kernel=kernel)
+            grid_points.inc(n ** dim * (1 if isinstance(type, str) else len(type)))
+        elif dim == 1:
+            with timed('sensitivity'):
+                result = sensitivity_2D(type, None, S, K, r, v, T, n2D=n, kernel=kernel, lattice=lattice,
+                                        budget=budget)
+            if result.source is None:
+                grid_points.inc(len(result.axes[0]))
+        elif dim == 3:
+            with timed('sensitivity'):
+                result = sensitivity_4D(type, None, S, K, r, v, T, n3D=n, kernel=kernel)
+            grid_points.inc(n * n * ANIMATION_FRAMES)
+        else:
+            if set_progress is not None:
+                # Publish successively finer surfaces of the selected greek while the full one is computed
+                for step in PROGRESSIVE_STEPS:
+                    if step >= n:
+                        break
+                    preview = sensitivity_3D(type, None, S, K, r, v, T, n3D=step, kernel=kernel)
+                    if on in preview.values:
+                        set_progress((build_preview(preview.select(on), on, step, n),))
+                    grid_points.inc(step * step)
+            with timed('sensitivity'):
+                result = sensitivity_3D(type, None, S, K, r, v, T, n3D=n, kernel=kernel, workers=PARALLEL_WORKERS,
+                                        lattice=lattice, budget=budget)
+            if result.source is None:
+                grid_points.inc(len(result.axes[0]) * len(result.axes[1]))
+        return result
+
+    # All the greeks are stored, so that switching the "result" dropdown only picks another array.
+    # Identical requests running at the same time share one computation, see ResultCache.get_or_compute.
+    result = results.get_or_compute(key, compute)
+
+    # The matrix is only built when its tab is opened, see greek_table
+    with timed('build_figure'):
+        figure = build_figure(result.select(on), on) if on in result.values else unavailable(on)
+    tabs = [build_tabs(figure)]
+
+    with timed('serialization'):
+        outputs.set(output_key, tabs)
+    return tabs, key
@@ -0,0 +1,128 @@
+import io
+import os
+import sys
+from functools import partial
+from math import exp, log, sqrt
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import norm
+
+# The modules of script/ import each other by their flat names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'script'))
+
+from black_scholes_functions import (ALL_GREEKS, GREEKS, Grid, black_scholes_merton, black_scholes_merton_batch,
+                                     sensitivity_points)
+from export import grid_columns, stream_csv, stream_npy
+from implied_volatility import implied_volatility
+from lattice import binomial_lattice
+
+
+def scalar_black_scholes_merton(type, S, K, r, volatility, T):
+    # The scalar formulas the vectorized kernel replaced
+    d1 = (log(S / K) + (r + volatility ** 2 / 2) * T) / (volatility * sqrt(T))
+    d2 = d1 - volatility * sqrt(T)
+    sign = 1 if type == 'call' else -1
+    Nd1, Nd2, Nd1_ = norm.cdf(sign * d1), norm.cdf(sign * d2), norm.pdf(d1)
+    return {'price': sign * (S * Nd1 - K * exp(-r * T) * Nd2),
+            'delta': sign * Nd1,
+            'theta': - (S * Nd1_ * volatility) / (2 * sqrt(T)) - sign * r * K * exp(-r * T) * Nd2,
+            'gamma': Nd1_ / (S * volatility * sqrt(T)),
+            'vega': S * sqrt(T) * Nd1_,
+            'rho': sign * K * T * exp(-r * T) * Nd2}
+
+
+def random_contracts(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(50, 150, n), rng.uniform(50, 150, n), rng.uniform(0, 0.1, n), rng.uniform(0.05, 0.8, n),
+            rng.uniform(0.05, 3, n))
+
+
+@pytest.mark.parametrize('type', ['call', 'put'])
+def test_kernel_matches_scalar_formulas(type):
+    S, K, r, volatility, T = random_contracts(200)
+    values = black_scholes_merton(type, S, K, r, volatility, T)
+    for i in range(len(S)):
+        expected = scalar_black_scholes_merton(type, S[i], K[i], r[i], volatility[i], T[i])
+        for greek in GREEKS:
+            assert values[greek][i] == pytest.approx(expected[greek], rel=1e-9, abs=1e-12)
+
+
+def test_implied_volatility_round_trip():
+    S, K, r, volatility, T = random_contracts(500, seed=1)
+    types = np.where(np.arange(len(S)) % 2, 'call', 'put')
+    values = black_scholes_merton_batch(types, S, K, r, volatility, T, greeks=['price', 'vega'])
+
+    solved = implied_volatility(types, values['price'], S, K, r, T)
+    # Deep out of the money, a price only pins sigma down to IV_TOLERANCE / vega: those quotes may be flagged
+    identifiable = values['vega'] > 1e-2
+    assert identifiable.mean() > 0.9
+    assert solved['converged'][identifiable].all()
+    np.testing.assert_allclose(solved['sigma'][identifiable], volatility[identifiable], atol=1e-6)
+    np.testing.assert_allclose(solved['sigma'][solved['converged']], volatility[solved['converged']], atol=1e-4)
+
+
+@pytest.mark.parametrize('method', ['leisen_reimer', 'crr'])
+def test_european_lattice_matches_closed_form(method):
+    S, K, r, volatility, T = np.linspace(80, 120, 9), 100, 0.03, 0.25, 1
+    for type in ['call', 'put']:
+        exact = black_scholes_merton(type, S, K, r, volatility, T)
+        values = binomial_lattice(type, S, K, r, volatility, T, greeks=['price', 'delta'], steps=401,
+                                  method=method, american=False)
+        # The price converges in O(1/n²) with Leisen-Reimer, O(1/n) with CRR; the delta of the tree in O(1/n)
+        np.testing.assert_allclose(values['price'], exact['price'], atol=1e-4 if method == 'leisen_reimer' else 5e-2)
+        np.testing.assert_allclose(values['delta'], exact['delta'], atol=1e-3 if method == 'leisen_reimer' else 1e-2)
+
+
+@pytest.mark.parametrize('swept, bounds', [([0], [(80, 120)]),
+                                           ([0, 4], [(80, 120), (0.1, 2)]),
+                                           ([3, 4], [(0.3, 0.1), (2, 0.5)])])
+def test_tiled_grid_matches_direct_evaluation(swept, bounds, tmp_path, monkeypatch):
+    # tiles.py caches its tiles in ./cache
+    monkeypatch.chdir(tmp_path)
+    from tiles import tiled_grid
+
+    variables = [100, 100, 0.03, 0.25, 1]
+    task = partial(sensitivity_points, 'call', variables, swept, ALL_GREEKS, black_scholes_merton)
+    context = ('call', [None if i in swept else x for i, x in enumerate(variables)], swept, str(tmp_path))
+
+    # Twice: the second grid, over a wider range, reuses the tiles of the first
+    for widen in [1, 1.5]:
+        wider = [(lo, lo + (hi - lo) * widen) for lo, hi in bounds]
+        values, axes = tiled_grid(task, context, wider, 50)
+        for axis, (lo, hi) in zip(axes, wider):
+            assert axis[0] == min(lo, hi) and axis[-1] == max(lo, hi)
+            assert np.all(np.diff(axis) > 0)
+        direct = task(axes)
+        for greek in ALL_GREEKS:
+            np.testing.assert_allclose(values[greek], direct[greek], rtol=1e-12, atol=1e-15)
+
+
+def grid():
+    axes = [np.linspace(80, 120, 7), np.linspace(0.1, 2, 5)]
+    S, T = np.meshgrid(*axes, indexing='ij')
+    values = black_scholes_merton('call', S, 100, 0.03, 0.25, T)
+    return Grid({greek: values[greek] for greek in GREEKS}, axes, ['Underlying price (S)', 'Maturity (T)'])
+
+
+def test_csv_export_round_trip():
+    result = grid()
+    frame = pd.read_csv(io.BytesIO(b''.join(stream_csv(result))))
+    assert list(frame.columns) == grid_columns(result)
+    S, T = np.meshgrid(*result.axes, indexing='ij')
+    np.testing.assert_allclose(frame['Underlying price (S)'], S.ravel())
+    np.testing.assert_allclose(frame['Maturity (T)'], T.ravel())
+    for greek in GREEKS:
+        np.testing.assert_allclose(frame[greek], result.values[greek].ravel(), rtol=1e-11)
+
+
+def test_npy_export_round_trip():
+    result = grid()
+    array = np.load(io.BytesIO(b''.join(stream_npy(result))))
+    assert list(array.dtype.names) == grid_columns(result)
+    S, T = np.meshgrid(*result.axes, indexing='ij')
+    np.testing.assert_array_equal(array['Underlying price (S)'], S.ravel())
+    np.testing.assert_array_equal(array['Maturity (T)'], T.ravel())
+    for greek in GREEKS:
+        np.testing.assert_array_equal(array[greek], result.values[greek].ravel())